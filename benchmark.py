@@ -0,0 +1,678 @@
+# -*- coding: utf-8 -*-
+"""
+性能基准脚本
+用法: python benchmark.py [omr_plan ...]   (不带参数则运行全部)
+      SLIP_PHOTOS=<目录> python benchmark.py ocr_preprocess   (用真实投注单照片，否则用合成图)
+"""
+import sys
+import time
+import timeit
+
+# === 测试样本 ===
+def sample_bets(n, play_type="RFSF"):
+    weeks = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+    codes = {"RFSF": ["3", "0"], "DXF": ["1", "2"]}[play_type]
+    return [
+        {"match": f"{weeks[i % 7]}{(i * 37) % 1000:03d}", "type": play_type, "machine_choice": codes[i % 2]}
+        for i in range(n)
+    ]
+
+def report(label, seconds, number):
+    print(f"  {label:<28} {seconds / number * 1000:8.3f} ms/ticket")
+
+# === OMR: JSON 遍历 vs 预编译版面 ===
+# 优化前 OMREngine 的逐块绘制实现 (每张票遍历模板 JSON)，仅用于对比
+def legacy_draw_block(draw, x, y, w, h, filled=True):
+    if filled: draw.rectangle([x, y, x+w, y+h], fill=0)
+    else: draw.rectangle([x, y, x+w, y+h], outline=0, fill=1)
+
+# 绘制通用倍数
+def legacy_draw_multiplier_grid(draw, multi, cfg):
+    m_val = int(multi)
+    targets = []
+    # 假设 cfg['rows'] 里的 vals 是字符，需转换
+    all_vals = []
+    for r in cfg['rows']: 
+        for v in r['vals']: all_vals.append(int(v))
+    all_vals.sort(reverse=True)
+    
+    temp = m_val
+    for v in all_vals:
+        if temp >= v:
+            targets.append(str(v))
+            temp -= v
+    
+    start_x = cfg['start_x']
+    gap_x = cfg['gap_x']
+    for row in cfg['rows']:
+        for i, val_str in enumerate(row['vals']):
+            # 面值可能是整数 (bb_rfsf_3)，统一按字符串比较
+            if str(val_str) in targets:
+                legacy_draw_block(draw, start_x + i*gap_x, row['y'], 25, 14)
+
+# 单层加法制 (RFSF3, DXF3)
+def legacy_generate_additive_3(engine, bets, pass_type, multiplier, map_name):
+    from PIL import Image, ImageDraw
+    cfg = engine.maps.get(map_name)
+    if not cfg: return Image.new('1', (576, 100), 1)
+    
+    width, height = cfg['meta']['width'], cfg['meta']['height']
+    img = Image.new('1', (width, height), 1)
+    draw = ImageDraw.Draw(img)
+    
+    # 绘制锚点和线
+    draw.line([10, 120, 566, 120], fill=0, width=2)
+    draw.line([10, 450, 566, 450], fill=0, width=2)
+    for i in range(0, height, 30): draw.rectangle([0, i, 15, i+15], fill=0)
+
+    for idx, bet in enumerate(bets):
+        if idx >= 3: break
+        base_x = cfg['layout']['columns'][idx]['x_offset']
+        
+        # 解析周数和数字
+        week_str = bet['match'][:2]
+        num_str = ''.join(filter(str.isdigit, bet['match']))[-3:]
+        h, t, u = int(num_str[0]), int(num_str[1]), int(num_str[2])
+        
+        # 1. 涂周
+        if week_str in cfg['layout']['rows']['week']['map']:
+            wi = cfg['layout']['rows']['week']['map'].index(week_str)
+            row_add = 30 if wi >= 4 else 0
+            wx = base_x + (wi % 4) * cfg['layout']['rows']['week']['gap_x']
+            legacy_draw_block(draw, wx, cfg['layout']['rows']['week']['start_y'] + row_add, 25, 14)
+
+        # 2. 涂编号 (加法)
+        num_cfg = cfg['layout']['rows']['match_num_additive']
+        for digit, key in zip([u, t, h], ['units', 'tens', 'hundreds']):
+            comps = engine._get_additive_components(digit)
+            for i, val in enumerate(num_cfg[key]['vals']):
+                if val in comps:
+                    legacy_draw_block(draw, base_x + i*35, num_cfg[key]['y'], 25, 14)
+
+        # 3. 涂选项
+        code = str(bet['machine_choice'])
+        opt_cfg = cfg['layout']['rows']['options']
+        if code in opt_cfg:
+            legacy_draw_block(draw, base_x + opt_cfg[code]['x_rel'], opt_cfg['label_y'], 25, 14)
+
+    # 4. 底部
+    if pass_type in cfg['layout']['footer']['pass']:
+        p = cfg['layout']['footer']['pass'][pass_type]
+        legacy_draw_block(draw, p['x'], p['y'], 25, 14)
+        
+    legacy_draw_multiplier_grid(draw, multiplier, cfg['layout']['footer']['multi'])
+    return img
+
+# 双层加法制 (RFSF6, DXF6)
+def legacy_generate_additive_6(engine, bets, pass_type, multiplier, map_name):
+    from PIL import Image, ImageDraw
+    cfg = engine.maps.get(map_name)
+    if not cfg: return Image.new('1', (576, 100), 1)
+    
+    width, height = cfg['meta']['width'], cfg['meta']['height']
+    img = Image.new('1', (width, height), 1)
+    draw = ImageDraw.Draw(img)
+    
+    draw.line([10, 130, 566, 130], fill=0, width=2)
+    draw.line([10, 560, 566, 560], fill=0, width=2)
+    draw.line([10, 930, 566, 930], fill=0, width=2)
+    for i in range(0, height, 30): draw.rectangle([0, i, 15, i+15], fill=0)
+
+    for idx, bet in enumerate(bets):
+        if idx >= 6: break
+        is_top = idx < 3
+        base_y = cfg['layout']['blocks']['top']['base_y'] if is_top else cfg['layout']['blocks']['bottom']['base_y']
+        col_idx = idx if is_top else idx - 3
+        base_x = cfg['layout']['columns'][col_idx]['x_offset']
+        rows_rel = cfg['layout']['rows_relative']
+        
+        # 解析
+        week_str = bet['match'][:2]
+        num_str = ''.join(filter(str.isdigit, bet['match']))[-3:]
+        h, t, u = int(num_str[0]), int(num_str[1]), int(num_str[2])
+        
+        # 1. 涂周
+        if week_str in rows_rel['week']['map']:
+            wi = rows_rel['week']['map'].index(week_str)
+            row_add = 30 if wi >= 4 else 0
+            wx = base_x + (wi % 4) * rows_rel['week']['gap_x']
+            legacy_draw_block(draw, wx, base_y + rows_rel['week']['start_y'] + row_add, 25, 14)
+            
+        # 2. 涂编号
+        num_cfg = rows_rel['match_num_additive']
+        for digit, key in zip([u, t, h], ['units', 'tens', 'hundreds']):
+            comps = engine._get_additive_components(digit)
+            for i, val in enumerate(num_cfg[key]['vals']):
+                if val in comps:
+                    legacy_draw_block(draw, base_x + i*35, base_y + num_cfg[key]['y'], 25, 14)
+                    
+        # 3. 涂选项
+        code = str(bet['machine_choice'])
+        if code in rows_rel['options']:
+            legacy_draw_block(draw, base_x + rows_rel['options'][code]['x_rel'], base_y + rows_rel['options']['label_y'], 25, 14)
+
+    # 4. 底部
+    if pass_type in cfg['layout']['footer']['pass']:
+        p = cfg['layout']['footer']['pass'][pass_type]
+        legacy_draw_block(draw, p['x'], p['y'], 25, 14)
+    legacy_draw_multiplier_grid(draw, multiplier, cfg['layout']['footer']['multi'])
+    return img
+
+def bench_omr_plan(number=300):
+    from omr_engine import OMREngine
+    engine = OMREngine()
+    print("[omr_plan] 旧版 JSON 遍历 vs 预编译版面")
+    for n, pt, gen, name in [
+        (3, "3x1", legacy_generate_additive_3, "basketball_rfsf_3"),
+        (6, "6x1", legacy_generate_additive_6, "basketball_rfsf_6"),
+    ]:
+        bets = sample_bets(n)
+        old = gen(engine, bets, pt, "10", name)
+        new = engine.dispatch(bets, pt, "10", "RFSF")
+        assert old.tobytes() == new.tobytes(), f"{name}: 像素不一致"
+        report(f"{name} legacy", timeit.timeit(lambda: gen(engine, bets, pt, "10", name), number=number), number)
+        report(f"{name} plan", timeit.timeit(lambda: engine.dispatch(bets, pt, "10", "RFSF"), number=number), number)
+
+# === OMR: ImageDraw vs 位图盖章 (含逐像素一致性校验) ===
+def check_bitmap_equivalence(engine):
+    """位图盖章得到的光栅与 ImageDraw 逐块绘制的卡面逐像素一致"""
+    from PIL import Image
+    for play in ["RFSF", "DXF"]:
+        for pt in ["单关", "2x1", "3x1", "4x1", "5x1", "6x1", "单场"]:
+            for mu in ["1", "7", "10", "33", "99", "150"]:
+                for n in range(1, 8):
+                    bets = sample_bets(n, play)
+                    a = engine.dispatch(bets, pt, mu, play)
+                    x_bytes, height, data = engine.dispatch_raster(bets, pt, mu, play)
+                    b = Image.frombytes('1', (x_bytes * 8, height), data, 'raw', '1;I')
+                    assert a.size == b.size and a.tobytes() == b.tobytes(), (play, pt, mu, n)
+
+def bench_omr_bitmap(number=300):
+    from omr_engine import OMREngine
+    engine = OMREngine()
+    check_bitmap_equivalence(engine)
+    print("[omr_bitmap] ImageDraw 出 Image vs 位图盖章出光栅 (像素一致性校验通过)")
+    for n, pt in [(3, "3x1"), (6, "6x1")]:
+        bets = sample_bets(n)
+        report(f"{n}-game dispatch (pil)", timeit.timeit(lambda: engine.dispatch(bets, pt, "10", "RFSF"), number=number), number)
+        report(f"{n}-game dispatch_raster", timeit.timeit(lambda: engine.dispatch_raster(bets, pt, "10", "RFSF"), number=number), number)
+
+# === 出票链路: Image -> image_to_commands vs 光栅直出 ===
+def bench_omr_raster(number=300):
+    from omr_engine import OMREngine
+    from driver import EscPosDriver
+    engine, driver = OMREngine(), EscPosDriver()
+    print("[omr_raster] dispatch + image_to_commands vs dispatch_raster + raster_to_commands")
+    for n, pt in [(3, "3x1"), (6, "6x1")]:
+        bets = sample_bets(n)
+        via_image = lambda: driver.image_to_commands(engine.dispatch(bets, pt, "10", "RFSF"))
+        direct = lambda: driver.raster_to_commands(*engine.dispatch_raster(bets, pt, "10", "RFSF"))
+        assert via_image() == direct(), f"{n}-game: 指令不一致"
+        report(f"{n}-game via image", timeit.timeit(via_image, number=number), number)
+        report(f"{n}-game direct raster", timeit.timeit(direct, number=number), number)
+
+# === 光栅转换: 逐字节异或 vs 批量打包 ===
+def legacy_image_to_commands(img):
+    """优化前的 image_to_commands 实现，仅用于对比"""
+    from PIL import Image
+    if img.width > 576:
+        img = img.resize((576, int(img.height * 576 / img.width)), Image.Resampling.LANCZOS)
+    img = img.convert('1')
+    w, h = img.size
+    cmd = b'\x1D\x76\x30\x00' + ((w + 7) // 8).to_bytes(2, 'little') + h.to_bytes(2, 'little')
+    return cmd + bytearray([b ^ 0xFF for b in img.tobytes()]) + b'\n\n\n\x1D\x56\x00'
+
+def bench_raster_pack(number=100):
+    from omr_engine import OMREngine
+    from driver import EscPosDriver
+    engine, driver = OMREngine(), EscPosDriver()
+    print("[raster_pack] image_to_commands: 逐字节异或 vs '1;I' 批量打包")
+    for n, pt in [(3, "3x1"), (6, "6x1")]:
+        img = engine.dispatch(sample_bets(n), pt, "10", "RFSF")
+        assert legacy_image_to_commands(img) == driver.image_to_commands(img), f"{n}-game: 指令不一致"
+        report(f"{n}-game legacy", timeit.timeit(lambda: legacy_image_to_commands(img), number=number), number)
+        report(f"{n}-game vectorized", timeit.timeit(lambda: driver.image_to_commands(img), number=number), number)
+
+# === 紧凑光栅: 线路字节数 ===
+def decode_compact_raster(cmds, x_bytes):
+    """把紧凑模式指令还原为整图光栅，用于校验"""
+    rows, i = [], 0
+    while i < len(cmds):
+        if cmds[i:i + 3] == b'\x1B\x61\x00':
+            i += 3
+        elif cmds[i:i + 2] == b'\x1B\x4A':
+            rows += [bytes(x_bytes)] * cmds[i + 2]; i += 3
+        elif cmds[i:i + 4] == b'\x1D\x76\x30\x00':
+            w, h = int.from_bytes(cmds[i + 4:i + 6], 'little'), int.from_bytes(cmds[i + 6:i + 8], 'little')
+            i += 8
+            for _ in range(h):
+                rows.append(cmds[i:i + w] + bytes(x_bytes - w)); i += w
+        else:
+            break
+    return b''.join(rows)
+
+def bench_raster_compact(number=100):
+    from omr_engine import OMREngine
+    from driver import EscPosDriver
+    engine, driver = OMREngine(), EscPosDriver(compact_raster=True)
+    print("[raster_compact] 整图 GS v 0 vs 空白走纸 + 条带")
+    for n, pt in [(3, "3x1"), (6, "6x1")]:
+        raster = engine.dispatch_raster(sample_bets(n), pt, "10", "RFSF")
+        assert decode_compact_raster(driver.raster_to_commands(*raster), raster[0]) == raster[2], f"{n}-game: 还原不一致"
+        r = driver.last_raster_report
+        print(f"  {n}-game bytes: raw {r['raw_bytes']} -> sent {r['sent_bytes']} "
+              f"({r['saved_bytes'] * 100 // r['raw_bytes']}% saved, {r['bands']} bands, {r['feed_rows']} feed rows)")
+        report(f"{n}-game compact encode", timeit.timeit(lambda: driver.raster_to_commands(*raster), number=number), number)
+
+# === 多票并行渲染: 进程数扩展性 ===
+def bench_render_scaling(tickets=800):
+    from logic import SportteryRuleEngine
+    from render_pool import RenderService
+    bets = [dict(b, choice={"3": "让胜", "0": "让负"}[b.pop("machine_choice")]) for b in sample_bets(tickets * 6)]
+    order = SportteryRuleEngine().generate_ticket_data(bets, "6x1", "10")["tickets"]
+    print(f"[render_scaling] {len(order)} 张 6 关票, compact raster")
+    baseline = None
+    for workers in [1, 2, 4, 8]:
+        service = RenderService(workers=workers, compact_raster=True).start()
+        out = service.render_commands(order, "6x1", "10")
+        if baseline is None: baseline = out
+        assert out == baseline, f"{workers} workers: 结果不一致"
+        seconds = timeit.timeit(lambda: service.render_commands(order, "6x1", "10"), number=3) / 3
+        service.shutdown()
+        print(f"  {workers} worker(s)  {seconds * 1000:8.1f} ms/order  {len(order) / seconds:8.0f} tickets/s")
+
+# === 选项码解析: 线性子串扫描 vs 预编译解析器 ===
+def legacy_get_code(rules, category, play_type, choice):
+    """优化前的 get_code 实现，仅用于对比"""
+    if category == "number": return choice
+    play_map = rules.get(category, {}).get(play_type.upper(), {})
+    if choice in play_map: return play_map[choice]
+    for key, val in play_map.items():
+        if key in choice: return val
+    return choice
+
+def sample_choices(n):
+    from logic import SportteryRuleEngine
+    engine = SportteryRuleEngine()
+    pool = []
+    for category in ["football", "basketball"]:
+        for play_type, play_map in engine.rules[category].items():
+            for key in play_map:
+                # 精确 / 带赔率 / 带让分 / 无法识别 四种写法
+                for choice in [key, f"{key}[1.85]", f"({play_type}){key}@2.10", f"?{key[::-1]}?"]:
+                    pool.append((category, play_type, choice))
+    return engine, [pool[(i * 7919) % len(pool)] for i in range(n)]
+
+def bench_option_resolver(n=100000):
+    engine, samples = sample_choices(n)
+    diffs = sum(1 for c, p, ch in set(samples) if legacy_get_code(engine.rules, c, p, ch) != engine.get_code(c, p, ch))
+    print(f"[option_resolver] {n} 条选项 ({len(set(samples))} 种写法, 与旧版结果不同 {diffs} 种)")
+    for label, fn in [("legacy scan", lambda: [legacy_get_code(engine.rules, c, p, ch) for c, p, ch in samples]),
+                      ("resolver (no cache)", lambda: [engine.resolver._resolve(c, p, ch) for c, p, ch in samples]),
+                      ("resolver", lambda: [engine.get_code(c, p, ch) for c, p, ch in samples])]:
+        seconds = min(timeit.repeat(fn, number=1, repeat=3))
+        print(f"  {label:<28} {seconds * 1000:8.1f} ms  {n / seconds:10.0f} choices/s")
+
+# === 场次号归一化: 逐个星期子串 + 未编译正则 vs 单次预编译正则 + LRU ===
+def legacy_normalize_match_id(raw_text, category="football"):
+    """优化前的 SportteryRuleEngine.normalize_match_id，仅用于对比"""
+    import re
+    from logic import WEEK_MAP
+    if category == "number":
+        digits = re.findall(r'\d+', raw_text)
+        return digits[0] if digits else raw_text
+    for cn, num in WEEK_MAP.items():
+        if cn in raw_text:
+            digits = re.findall(r'\d+', raw_text)
+            if digits: return f"{num}{digits[0].zfill(3)}"
+    if re.match(r'^\d{4,5}$', raw_text): return raw_text
+    return raw_text
+
+def bench_match_id(n=100000):
+    from logic import normalize_match_id
+    weeks = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+    # 一天约几十场，场次号高度重复；混入已是机器码和带空格的写法
+    ids = [[f"{weeks[i % 7]}{i % 60:03d}", f"{weeks[i % 7]} {i % 60}", f"{i % 7 + 1}{i % 60:03d}"][i % 3] for i in range(n)]
+    for raw in set(ids):
+        assert legacy_normalize_match_id(raw) == normalize_match_id(raw), raw
+    print(f"[match_id] {n} 个场次号 ({len(set(ids))} 种, 结果与旧版一致)")
+    for label, fn in [("legacy", lambda: [legacy_normalize_match_id(r) for r in ids]),
+                      ("compiled (no cache)", lambda: [normalize_match_id.__wrapped__(r) for r in ids]),
+                      ("compiled + lru", lambda: [normalize_match_id(r) for r in ids])]:
+        seconds = min(timeit.repeat(fn, number=1, repeat=3))
+        print(f"  {label:<28} {seconds * 1000:8.1f} ms  {n / seconds:10.0f} ids/s")
+
+# === 拆单: 逐注字典 vs 分组拆单 / 列式批量 ===
+def legacy_generate_ticket_data(engine, bets, pass_type, multiplier):
+    """优化前的 generate_ticket_data (逐注构建)，仅用于对比"""
+    if not bets: return {"tickets": [], "count": 0}
+    cat = engine.get_category(bets[0]['type'])
+    limit = 5 if cat == "number" else engine.determine_capacity(bets, pass_type)
+    final_tickets = []
+    for chunk in [bets[i:i + limit] for i in range(0, len(bets), limit)]:
+        human_readable, machine_codes = [], []
+        for b in chunk:
+            m_id = engine.normalize_match_id(b['match'], cat)
+            o_code = engine.get_code(cat, b['type'], b['choice'])
+            if not o_code and cat != "number": continue
+            human_readable.append({"match_raw": b['match'], "match_code": m_id, "type": b['type'],
+                                   "choice": b['choice'], "machine_choice": o_code})
+            machine_codes.append(f"{m_id}-{o_code}")
+        if not human_readable: continue
+        final_tickets.append({
+            "title": engine.generate_title(cat, chunk[0]['type'], limit),
+            "human_readable": human_readable,
+            "machine_qr": ",".join(machine_codes) + f"|{pass_type}|{multiplier}",
+            "meta": {"category": cat, "play_type": chunk[0]['type'], "capacity": limit}
+        })
+    return {"tickets": final_tickets, "count": len(final_tickets)}
+
+def sample_order(n, play_type="RFSF"):
+    """整单样本，约 2% 的行无法取码 (空选项)"""
+    choices = {"RFSF": ["让胜", "让分主负[+3.5]", "3"], "DXF": ["大", "小分[201.5]", "1"],
+               "P3": ["1", "5", "9"]}[play_type]
+    return [dict(b, type=play_type, choice="" if i % 50 == 7 else choices[(i * 7) % 11 % 3])
+            for i, b in enumerate(sample_bets(n, "RFSF"))]
+
+def bench_ticket_bulk():
+    from logic import SportteryRuleEngine
+    engine = SportteryRuleEngine()
+    for play_type, pt in [("RFSF", "2x1"), ("DXF", "6x1"), ("P3", "单式")]:
+        bets = sample_order(500, play_type)
+        cols = [[b[k] for b in bets] for k in ("match", "type", "choice")]
+        # 逐注路径 (流式) 为基准；旧版定长切片的拆法不同 (见 ticket_packing)，只作计时参考
+        expected = list(engine.iter_ticket_data(bets, pt, "10"))
+        assert engine.generate_ticket_data(bets, pt, "10")["tickets"] == expected, play_type
+        assert engine.generate_ticket_data_bulk(*cols, pt, "10")["tickets"] == expected, play_type
+    mixed = [b for rows in zip(sample_order(300, "RFSF"), sample_order(300, "DXF"), sample_order(300, "P3")) for b in rows]
+    cols = [[b[k] for b in mixed] for k in ("match", "type", "choice")]
+    assert engine.generate_ticket_data_bulk(*cols, "2x1", "10") == engine.generate_ticket_data(mixed, "2x1", "10")
+    print("[ticket_bulk] 旧版逐注 vs 分组拆单 (注单字典 / 列式) (结果一致性校验通过)")
+    for n in [10000, 100000]:
+        bets = sample_order(n)
+        cols = [[b[k] for b in bets] for k in ("match", "type", "choice")]
+        for label, fn in [("legacy per-bet", lambda: legacy_generate_ticket_data(engine, bets, "6x1", "10")),
+                          ("generate_ticket_data", lambda: engine.generate_ticket_data(bets, "6x1", "10")),
+                          ("bulk (columns)", lambda: engine.generate_ticket_data_bulk(*cols, "6x1", "10"))]:
+            seconds = min(timeit.repeat(fn, number=1, repeat=3))
+            print(f"  {n:>6} {label:<22} {seconds * 1000:8.1f} ms  {n / seconds:10.0f} bets/s")
+
+# === 拆单: 整单列表 vs 流式生成器 (首张票延迟 + 峰值内存) ===
+def bench_ticket_stream(n=100000):
+    import tracemalloc
+    from logic import SportteryRuleEngine
+    engine = SportteryRuleEngine()
+    for play_type, pt in [("RFSF", "2x1"), ("DXF", "6x1"), ("P3", "单式")]:
+        bets = sample_order(500, play_type)
+        assert list(engine.iter_ticket_data(iter(bets), pt, "10")) == engine.generate_ticket_data(bets, pt, "10")["tickets"]
+    # 混合订单 (足球 / 篮球 / 数字彩交错)
+    mixed = [b for rows in zip(sample_order(300, "RFSF"), sample_order(300, "DXF"), sample_order(300, "P3")) for b in rows]
+    mixed += [dict(b, type="SPF", choice="胜") for b in sample_bets(50)]
+    assert list(engine.iter_ticket_data(iter(mixed), "2x1", "10")) == engine.generate_ticket_data(mixed, "2x1", "10")["tickets"]
+    print(f"[ticket_stream] {n} 注 6 关, 逐行产生注单 (结果一致性校验通过)")
+
+    def rows():
+        # 模拟逐行读取的导入文件：注单本身也不整体驻留内存
+        for i in range(n):
+            yield {"match": f"周{'一二三四五六日'[i % 7]}{i % 60:03d}", "type": "RFSF", "choice": "让胜" if i % 3 else "让负"}
+
+    for label, make in [("list", lambda: engine.generate_ticket_data(list(rows()), "6x1", "10")["tickets"]),
+                        ("stream", lambda: engine.iter_ticket_data(rows(), "6x1", "10"))]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        first = None
+        for t in make():
+            if first is None: first = time.perf_counter() - start
+        total = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  {label:<8} first ticket {first * 1000:8.1f} ms  total {total * 1000:8.1f} ms  peak {peak / 1024:9.0f} KB")
+
+# === 拆单规划: 定长切片 vs 按模板容量 + 最少场次打包 ===
+def bench_ticket_packing():
+    from logic import SportteryRuleEngine
+    from omr_engine import OMREngine
+    engine = SportteryRuleEngine()
+    engine.register_templates(OMREngine().template_capacities())
+    print("[ticket_packing] 旧版张数 -> 规划张数 (省下, 不足场次的票)")
+    for pt in ["1x1", "2x1", "3x1", "4x1", "6x1"]:
+        cells = []
+        for n in [7, 10, 25, 100, 1000]:
+            bets = [dict(b, choice="让胜") for b in sample_bets(n)]
+            result = engine.generate_ticket_data(bets, pt, "10")
+            g = result["groups"][0]
+            legacy = legacy_generate_ticket_data(engine, bets, pt, "10")["count"]
+            cells.append(f"{n:>4}: {legacy:>3} -> {result['count']:<3} (-{legacy - result['count']}, {g['short']})")
+        print(f"  {pt:<4} " + "  ".join(cells))
+
+# === 批量文本导入: 单进程逐行 vs 进程池分块 ===
+def bench_batch_parse(lines=100000):
+    from logic import SportteryRuleEngine
+    from templates.parser import BatchParser
+    choices = ["胜", "平", "负/平", "1:0", "2：1,胜其他", "33", "bad"]
+    text = "".join(f"周{'一二三四五六日'[i % 7]}{i % 300:03d}-{choices[i % 7]}\n" if i % 97 else "# 备注\n"
+                   for i in range(lines))
+    baseline = list(BatchParser(SportteryRuleEngine(), workers=1).iter_parse(text))
+    print(f"[batch_parse] {lines} 行 ({sum('error' in r for r in baseline)} 行报错)")
+    for workers in [1, 2, 4]:
+        parser = BatchParser(SportteryRuleEngine(), workers=workers)
+        assert list(parser.parse_stream(text)) == baseline, f"{workers} workers: 结果不一致"
+        seconds = min(timeit.repeat(lambda: sum(1 for _ in parser.parse_stream(text)), number=1, repeat=3))
+        parser.shutdown()
+        print(f"  {workers} worker(s)  {seconds * 1000:8.1f} ms  {lines / seconds:10.0f} lines/s")
+
+# === 订单文件导入: 10 万行 CSV 流式 读取 -> 校验 -> 拆单 ===
+def bench_csv_import(rows=100000):
+    import os
+    import tempfile
+    import tracemalloc
+    from logic import SportteryRuleEngine
+    from order_import import OrderImporter, ImportProgress
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        f.write("场次,玩法,选项\n")
+        choices = [("RFSF", "让胜"), ("RFSF", "让分主负[+3.5]"), ("DXF", "大"), ("SPF", "胜"), ("CBF", "1:0"), ("RFSF", "胜")]
+        for i in range(rows):
+            play_type, choice = choices[i % len(choices)]
+            f.write(f"周{'一二三四五六日'[i % 7]}{i % 300:03d},{play_type},{choice}\n")
+    try:
+        importer = OrderImporter(SportteryRuleEngine())
+        progress = ImportProgress("bench")
+        tracemalloc.start()
+        start = time.perf_counter()
+        tickets = sum(1 for _ in importer.iter_tickets(path, "2x1", "10", progress))
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"[csv_import] {rows} 行 ({os.path.getsize(path) // 1024} KB): {progress.valid} 合法 / {progress.invalid} 报错 -> {tickets} 张票")
+        print(f"  {seconds * 1000:8.1f} ms  {rows / seconds:10.0f} rows/s  peak {peak / 1024:9.0f} KB")
+    finally:
+        os.remove(path)
+
+# === Umi-OCR 客户端: 每次新建连接 vs keep-alive 连接池 ===
+def start_fake_umi(delay=0.0):
+    """本地假 Umi-OCR 服务 (HTTP/1.1 keep-alive)，返回 (server, url)"""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True   # 头和正文分两次写，不关 Nagle 会撞上 40ms 延迟 ACK
+        def log_message(self, *args): pass
+        def _reply(self, body):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def do_GET(self):
+            self._reply(b"{}")
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if delay: time.sleep(delay)
+            self._reply(json.dumps({"code": 100, "data": [{"text": "周三001 胜", "score": 0.98, "box": [[0, 0], [9, 0], [9, 9], [0, 9]]}]}).encode())
+
+    import json
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/ocr"
+
+def legacy_umi_scan(url, img_bytes):
+    import base64
+    import requests
+    payload = {"base64": base64.b64encode(img_bytes).decode('utf-8'), "options": {"data.format": "json", "ocr.cls": True}}
+    r = requests.post(url, json=payload, timeout=8)
+    return r.json()
+
+def bench_ocr_client(number=300):
+    from io import BytesIO
+    from PIL import Image
+    from ocr_adapter import UmiOCRClient
+    buf = BytesIO()
+    Image.new('L', (64, 32), 255).save(buf, format='PNG')
+    img_bytes = buf.getvalue()
+    server, url = start_fake_umi()
+    try:
+        client = UmiOCRClient(url)
+        client._preprocess_image = lambda b: b   # 只比较传输，预处理两边都跳过
+        assert client.check_connection()
+        assert client.scan(img_bytes)["status"] == "ok"
+        print(f"[ocr_client] {number} 次扫描 (本地假服务)")
+        report("requests.post (每次握手)", timeit.timeit(lambda: legacy_umi_scan(url, img_bytes), number=number), number)
+        report("Session 连接池", timeit.timeit(lambda: client.scan(img_bytes), number=number), number)
+        print(f"  stats: {client.stats()}")
+        client.close()
+    finally:
+        server.shutdown()
+
+# === OCR 预处理: 全尺寸增强 + JPEG vs 缩放 + 按需增强 + 灰度 PNG ===
+def legacy_preprocess_image(img_bytes):
+    from io import BytesIO
+    from PIL import Image, ImageEnhance
+    img = Image.open(BytesIO(img_bytes)).convert('L')
+    img = ImageEnhance.Contrast(img).enhance(2.0)
+    img = ImageEnhance.Sharpness(img).enhance(1.5)
+    out = BytesIO()
+    img.save(out, format='JPEG', quality=90)
+    return out.getvalue()
+
+def sample_slip_photos():
+    """SLIP_PHOTOS 目录下的 jpg/png；没有时合成两张 12MP 手机照片 (低对比度 / 高对比度)"""
+    import os
+    import random
+    from io import BytesIO
+    from PIL import Image, ImageDraw
+    folder = os.environ.get("SLIP_PHOTOS")
+    if folder:
+        names = sorted(n for n in os.listdir(folder) if n.lower().endswith((".jpg", ".jpeg", ".png")))
+        return [(n, open(os.path.join(folder, n), 'rb').read()) for n in names]
+    photos = []
+    rnd = random.Random(7)
+    for name, paper, ink in (("synthetic_dim.jpg", (176, 170, 160), (96, 90, 88)), ("synthetic_flash.jpg", (250, 250, 248), (20, 20, 24))):
+        img = Image.new('RGB', (4000, 3000), paper)
+        draw = ImageDraw.Draw(img)
+        for row in range(40):
+            y = 150 + row * 68
+            x = 200
+            while x < 3700:
+                w = rnd.randint(20, 40)
+                draw.rectangle([x, y, x + w, y + 44], fill=ink)
+                x += w + rnd.randint(8, 30)
+        buf = BytesIO()
+        img.save(buf, format='JPEG', quality=92)
+        photos.append((name, buf.getvalue()))
+    return photos
+
+def bench_ocr_preprocess(number=3):
+    from io import BytesIO
+    from PIL import Image
+    from ocr_adapter import UmiOCRClient
+    photos = sample_slip_photos()
+    clients = {"png": UmiOCRClient(transport="png"), "jpeg": UmiOCRClient(transport="jpeg")}
+    print(f"[ocr_preprocess] {len(photos)} 张照片")
+    for name, data in photos:
+        legacy = legacy_preprocess_image(data)
+        out, info = clients["png"].preprocess(data)
+        assert max(Image.open(BytesIO(out)).size) <= clients["png"].max_side
+        print(f"  {name}: {info['src']} -> {info['size']} {'+'.join(info['stages']) or '无增强'}")
+        print(f"    {'旧流程 (全尺寸 + JPEG)':<26} {timeit.timeit(lambda: legacy_preprocess_image(data), number=number) / number * 1000:8.1f} ms  {len(legacy) // 1024:6d} KB")
+        for fmt, client in clients.items():
+            seconds = timeit.timeit(lambda: client.preprocess(data), number=number) / number
+            print(f"    {'新流程 ' + fmt:<26} {seconds * 1000:8.1f} ms  {len(client.preprocess(data)[0]) // 1024:6d} KB")
+
+# === 批量拍照识别: 串行 vs 有界线程池 ===
+def bench_ocr_batch(images=40, delay=0.05):
+    from io import BytesIO
+    from PIL import Image
+    from ocr_adapter import UmiOCRClient
+    from ocr_batch import OCRBatchService
+    buf = BytesIO()
+    Image.new('L', (1200, 900), 255).save(buf, format='PNG')
+    img_bytes = buf.getvalue()
+    server, url = start_fake_umi(delay)
+    try:
+        service = OCRBatchService(UmiOCRClient(url, pool_size=4), workers=4)
+        print(f"[ocr_batch] {images} 张照片，引擎每张 {delay * 1000:.0f} ms")
+        start = time.perf_counter()
+        serial = [service.process(img_bytes) for _ in range(images)]
+        print(f"  {'串行':<28} {(time.perf_counter() - start) * 1000:8.1f} ms")
+        start = time.perf_counter()
+        batch = list(service.iter_batch((f"{i}.png", img_bytes) for i in range(images)))
+        print(f"  {'线程池 x4':<28} {(time.perf_counter() - start) * 1000:8.1f} ms")
+        assert sorted(r["index"] for r in batch) == list(range(images))
+        assert all(r["bets"] == s["bets"] for r, s in zip(sorted(batch, key=lambda r: r["index"]), serial))
+        service.shutdown()
+    finally:
+        server.shutdown()
+
+# === OCR 结果缓存: 重复上传同一张照片 ===
+def bench_ocr_cache(number=20, delay=0.05):
+    import shutil
+    import tempfile
+    from ocr_adapter import UmiOCRClient
+    from cache_store import LRUCache, DiskCache, TieredCache
+    photo = sample_slip_photos()[0][1]
+    folder = tempfile.mkdtemp(prefix="ocr_cache_")
+    server, url = start_fake_umi(delay)
+    try:
+        plain = UmiOCRClient(url)
+        cached = UmiOCRClient(url, cache=TieredCache(LRUCache(), DiskCache(folder)))
+        first = cached.scan(photo)
+        assert first["status"] == "ok" and "cached" not in first
+        # 模拟重启：新的内存缓存 + 同一个磁盘目录
+        restarted = UmiOCRClient(url, cache=TieredCache(LRUCache(), DiskCache(folder)))
+        hit = restarted.scan(photo)
+        assert hit["cached"] and hit["data"] == first["data"]
+        print(f"[ocr_cache] 12MP 照片，引擎每张 {delay * 1000:.0f} ms")
+        report("无缓存", timeit.timeit(lambda: plain.scan(photo), number=number), number)
+        report("内存命中", timeit.timeit(lambda: cached.scan(photo), number=number), number)
+        disk_only = UmiOCRClient(url, cache=TieredCache(LRUCache(max_items=0), DiskCache(folder)))
+        report("磁盘命中", timeit.timeit(lambda: disk_only.scan(photo), number=number), number)
+        print(f"  stats: {cached.cache.stats()['memory']}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(folder)
+
+BENCHMARKS = {
+    "omr_plan": bench_omr_plan,
+    "omr_bitmap": bench_omr_bitmap,
+    "omr_raster": bench_omr_raster,
+    "raster_pack": bench_raster_pack,
+    "raster_compact": bench_raster_compact,
+    "render_scaling": bench_render_scaling,
+    "option_resolver": bench_option_resolver,
+    "match_id": bench_match_id,
+    "ticket_bulk": bench_ticket_bulk,
+    "ticket_stream": bench_ticket_stream,
+    "ticket_packing": bench_ticket_packing,
+    "batch_parse": bench_batch_parse,
+    "csv_import": bench_csv_import,
+    "ocr_client": bench_ocr_client,
+    "ocr_preprocess": bench_ocr_preprocess,
+    "ocr_batch": bench_ocr_batch,
+    "ocr_cache": bench_ocr_cache,
+}
+
+if __name__ == '__main__':
+    for key in (sys.argv[1:] or BENCHMARKS):
+        BENCHMARKS[key]()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+def content_hash(data):
+    """按内容取键 (上传的图片等)：同一份字节无论文件名如何都命中同一条缓存"""
+    return hashlib.sha1(data).hexdigest()
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存，按条目数和总字节数双重限额淘汰
+    命中 / 未命中 / 淘汰次数通过 stats() 暴露
+    """
+    def __init__(self, max_items=512, max_bytes=64 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()   # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        if size is None: size = len(value)
+        if size > self.max_bytes: return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None: self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while len(self._data) > self.max_items or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._data),
+                "bytes": self._bytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class DiskCache:
+    """
+    磁盘 LRU 缓存：每个条目一个 JSON 文件，按条目数和总字节数淘汰最久未用的
+    访问顺序用文件 mtime 记录，重启后按 mtime 恢复
+    """
+    def __init__(self, directory, max_items=2000, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._index = OrderedDict()   # 文件名 -> size
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith(".json"): continue
+            st = os.stat(os.path.join(directory, name))
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    def _name(self, key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + ".json"
+
+    def get(self, key, default=None):
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            if name not in self._index:
+                self.misses += 1
+                return default
+            try:
+                with open(path, 'rb') as f:
+                    value = json.loads(f.read())
+                os.utime(path)
+            except (OSError, ValueError):
+                # 文件被删或写坏：当作未命中并移出索引
+                self._bytes -= self._index.pop(name)
+                self.misses += 1
+                return default
+            self._index.move_to_end(name)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(data) > self.max_bytes: return
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            # 先写临时文件再替换，进程中途退出不会留下半个 JSON
+            tmp = path + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            old = self._index.pop(name, None)
+            if old is not None: self._bytes -= old
+            self._index[name] = len(data)
+            self._bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        while len(self._index) > self.max_items or self._bytes > self.max_bytes:
+            name, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try: os.remove(os.path.join(self.directory, name))
+            except OSError: pass
+
+    def clear(self):
+        with self._lock:
+            for name in self._index:
+                try: os.remove(os.path.join(self.directory, name))
+                except OSError: pass
+            self._index.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._index),
+                "bytes": self._bytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class TieredCache:
+    """
+    内存 LRUCache 在前、DiskCache 在后：先查内存，未命中再查磁盘并回填内存；写入两级都写
+    值须可 JSON 序列化
+    """
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not None: return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value, len(json.dumps(value, ensure_ascii=False)))
+                return value
+        return default
+
+    def put(self, key, value):
+        self.memory.put(key, value, len(json.dumps(value, ensure_ascii=False)))
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None: self.disk.clear()
+
+    def stats(self):
+        return {"memory": self.memory.stats(), "disk": self.disk.stats() if self.disk is not None else None}
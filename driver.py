@@ -2,8 +2,23 @@
 import datetime
 import sys
 from PIL import Image
+from printer_session import PrinterSessionPool
+
+# === 紧凑光栅参数 ===
+RASTER_BAND_ROWS = 128   # 单个 GS v 0 条带的最大行数
+FEED_MAX_DOTS = 255      # ESC J n 单条指令最多走纸 255 点 (XP-58 类机型 1 点 = 0.125mm)
+# 紧凑光栅的条带比纸宽窄，只有左对齐时才与整图对齐；文本票会留下 ESC a 1 (居中)，同一作业里要先复位
+CMD_ALIGN_LEFT = b'\x1B\x61\x00'
 
 class EscPosDriver:
+    def __init__(self, compact_raster=False, sessions=None):
+        # compact_raster: 空白行改为走纸指令，只传输有墨的条带
+        self.compact_raster = compact_raster
+        # sessions: 打印机句柄池 (可注入 FileBackend / SocketBackend 替身)
+        self.sessions = sessions or PrinterSessionPool()
+        # 最近一次光栅转换的字节统计 (每张票覆盖一次)
+        self.last_raster_report = None
+
     def get_printers(self):
         """获取系统所有打印机列表"""
         try:
@@ -23,41 +38,96 @@ class EscPosDriver:
         """
         try:
             # 1. 调整尺寸适配 80mm 热敏纸 (标准宽度约 576 dots)
-            # 如果图片过宽，按比例缩放；如果正好或较小，保持原样
+            # 已是 1-bit 且宽度不超标 (如 OMR 引擎输出) 时，跳过缩放和二值化
             target_w = 576
-            if img.width > target_w:
-                ratio = target_w / img.width
-                new_h = int(img.height * ratio)
-                img = img.resize((target_w, new_h), Image.Resampling.LANCZOS)
-            
-            # 2. 二值化处理 (确保只有黑白两色)
-            img = img.convert('1')
+            if img.mode != '1' or img.width > target_w:
+                # 如果图片过宽，按比例缩放；如果正好或较小，保持原样
+                if img.width > target_w:
+                    ratio = target_w / img.width
+                    new_h = int(img.height * ratio)
+                    img = img.resize((target_w, new_h), Image.Resampling.LANCZOS)
+                
+                # 2. 二值化处理 (确保只有黑白两色)
+                img = img.convert('1')
             
             # 3. 构建指令
             w, h = img.size
             x_bytes = (w + 7) // 8  # 每行需要的字节数
             
-            # GS v 0 m xL xH yL yH d1...dk
-            # m=0 (Normal mode)
-            cmd = b'\x1D\x76\x30\x00'
-            cmd += x_bytes.to_bytes(2, 'little') # 宽度 (字节数)
-            cmd += h.to_bytes(2, 'little')       # 高度 (点数)
-            
             # 4. 像素位反转
             # PIL 中: 0=黑, 1=白
             # ESC/POS 中: 1=打印(黑), 0=不打(白)
-            # 因此需要将 bits 反转
-            pixels = img.tobytes()
-            # 使用 bytearray 和异或操作进行反转
-            inverted = bytearray([b ^ 0xFF for b in pixels])
+            # 用反相打包模式 '1;I' 在 C 层一次完成打包 + 反转，不逐字节异或
+            inverted = img.tobytes('raw', '1;I')
             
             # 5. 拼接指令 + 切纸
-            return cmd + inverted + b'\n\n\n\x1D\x56\x00'
+            return self.raster_to_commands(x_bytes, h, inverted)
             
         except Exception as e:
             print(f"Image Conversion Error: {e}")
             return b''
 
+    def raster_to_commands(self, x_bytes, height, data):
+        """
+        将打包好的光栅数据 (打印机位极性 1=黑) 封装为 GS v 0 指令 + 切纸
+        OMREngine.dispatch_raster 的输出可直接传入，跳过 Image 中转
+        """
+        raw = self._gs_v0(x_bytes, height, data)
+        if self.compact_raster:
+            body, bands, feed_rows = self._compact_raster(x_bytes, height, data)
+        else:
+            body, bands, feed_rows = raw, 1, 0
+
+        self.last_raster_report = {
+            "raw_bytes": len(raw),
+            "sent_bytes": len(body),
+            "saved_bytes": len(raw) - len(body),
+            "bands": bands,
+            "feed_rows": feed_rows
+        }
+        return body + b'\n\n\n\x1D\x56\x00'
+
+    def _gs_v0(self, x_bytes, height, data):
+        # GS v 0 m xL xH yL yH d1...dk
+        # m=0 (Normal mode)
+        cmd = b'\x1D\x76\x30\x00'
+        cmd += x_bytes.to_bytes(2, 'little') # 宽度 (字节数)
+        cmd += height.to_bytes(2, 'little')  # 高度 (点数)
+        return cmd + data
+
+    def _compact_raster(self, x_bytes, height, data):
+        """
+        紧凑模式：连续空白行用 ESC J n 走纸代替，有墨的行按条带分段发送
+        每个条带只传到最右侧有墨的字节为止 (先发 ESC a 0 保证左对齐，右侧空白无需发送)
+        Returns: (指令, 条带数, 走纸行数)
+        """
+        widths = [len(data[y * x_bytes:(y + 1) * x_bytes].rstrip(b'\x00')) for y in range(height)]
+        cmds = [CMD_ALIGN_LEFT]
+        bands = feed_rows = 0
+        y = 0
+        while y < height:
+            # 1. 空白行 -> 走纸
+            start = y
+            while y < height and not widths[y]: y += 1
+            gap = y - start
+            feed_rows += gap
+            while gap > 0:
+                n = min(gap, FEED_MAX_DOTS)
+                cmds.append(b'\x1B\x4A' + bytes([n]))
+                gap -= n
+            if y >= height: break
+
+            # 2. 有墨且有效宽度相同的连续行 -> 一个条带 (超过 RASTER_BAND_ROWS 则继续切分)
+            start, w = y, widths[y]
+            while y < height and y - start < RASTER_BAND_ROWS and widths[y] == w: y += 1
+            if w == x_bytes:
+                band = data[start * x_bytes:y * x_bytes]
+            else:
+                band = b''.join(data[r * x_bytes:r * x_bytes + w] for r in range(start, y))
+            cmds.append(self._gs_v0(w, y - start, band))
+            bands += 1
+        return b''.join(cmds), bands, feed_rows
+
     def build_escpos(self, ticket_data, qr_data, pt, mu):
         """
         【兼容模式】生成基于文本的 OMR 仿真指令 (反白字符模式)
@@ -147,23 +217,11 @@ class EscPosDriver:
         return b''.join(cmds)
 
     def send_raw(self, printer_name, data):
-        """发送二进制数据到 Windows 打印机"""
+        """发送二进制数据到打印机 (复用常驻句柄)"""
         if not data:
             return False
-            
-        try:
-            import win32print
-            p = win32print.OpenPrinter(printer_name)
-            try:
-                # 开启打印作业
-                job = win32print.StartDocPrinter(p, 1, ("PrintBet Job", None, "RAW"))
-                win32print.StartPagePrinter(p)
-                win32print.WritePrinter(p, data)
-                win32print.EndPagePrinter(p)
-                win32print.EndDocPrinter(p)
-                return True
-            finally:
-                win32print.ClosePrinter(p)
-        except Exception as e:
-            print(f"[Driver Error] Send raw failed: {e}")
-            return False
+        return self.sessions.send(printer_name, data)
+
+    def send_batch(self, printer_name, chunks):
+        """多张票合并为一个假脱机文档发送，各票自带切纸指令"""
+        return self.sessions.send_batch(printer_name, chunks)
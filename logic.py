@@ -4,6 +4,9 @@ import os
 import sys
 import re
 import math
+import heapq
+from functools import lru_cache
+from operator import itemgetter
 
 # === 资源路径修正 (PyInstaller 兼容性核心) ===
 def resource_path(relative_path):
@@ -12,6 +15,137 @@ def resource_path(relative_path):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
+# === 场次号归一化 (竞彩 / 数字彩共用，main.py 也走这里) ===
+# 星期映射表 (Rule 2956 核心: 1=周一 ... 7=周日)
+WEEK_MAP = {
+    '周一': '1', '周二': '2', '周三': '3', '周四': '4',
+    '周五': '5', '周六': '6', '周日': '7'
+}
+# 一次扫描同时取出星期和其后的第一段数字: "周三305" -> ("周三", "305")
+_MATCH_ID_RE = re.compile('(' + '|'.join(WEEK_MAP) + r')\D*(\d+)')
+_DIGITS_RE = re.compile(r'\d+')
+
+@lru_cache(maxsize=8192)
+def normalize_match_id(raw_text, category="football"):
+    """
+    场次清洗引擎: 将人类可读场次转换为机器码
+    Input: "周三305" -> Output: "3305"；"周三1" -> "3001" (补齐3位)
+    同一天的场次号反复出现，结果做有界 LRU 缓存
+    """
+    if category == "number":
+        # 数字彩提取纯数字期号
+        m = _DIGITS_RE.search(raw_text)
+        return m.group() if m else raw_text
+
+    m = _MATCH_ID_RE.search(raw_text)
+    if m:
+        return f"{WEEK_MAP[m.group(1)]}{m.group(2).zfill(3)}"
+
+    # 兜底：输入已经是纯数字 (3305) 或无法识别，原样返回
+    return raw_text
+
+# 答题卡上的场次只有 星期 (1-7) + 三位编号
+_CARD_MATCH_RE = re.compile(r'[1-7]\d{3}')
+_WEEK_NAMES = {num: name for name, num in WEEK_MAP.items()}
+
+@lru_cache(maxsize=8192)
+def card_match_parts(raw_text):
+    """
+    场次 -> 答题卡涂写用的 (星期, 三位编号)
+    "周三5" / "周三 5" / "3005" -> ("周三", "005")；卡面表示不了的写法 (缺编号、五位编号等) 抛 ValueError
+    """
+    code = normalize_match_id(raw_text)
+    if not _CARD_MATCH_RE.fullmatch(code):
+        raise ValueError(f"场次无法涂写到答题卡: {raw_text}")
+    return _WEEK_NAMES[code[0]], code[1:]
+
+# === 拆单规划 ===
+_PASS_LEGS_RE = re.compile(r'(\d+)\s*(?:x|串)')
+# 前端的 "1x1" 在答题卡底部印作 "单关"
+PASS_ALIASES = {"1x1": "单关"}
+
+def pass_mark(pass_type):
+    """答题卡底部对应的过关方式 (拆单规划和 OMR 引擎共用): "1x1" -> "单关"，其余原样"""
+    return PASS_ALIASES.get(pass_type, pass_type)
+
+def pass_legs(pass_type):
+    """过关方式要求每张票的最少场次: "3x1" / "3串1" -> 3；单关 / 单场 -> 1"""
+    m = _PASS_LEGS_RE.search(pass_type or "")
+    return int(m.group(1)) if m else 1
+
+# 前端 / 导入文件可用的过关方式: "2x1"、"3串1"、单关 / 单式 / 单场
+_PASS_TYPE_RE = re.compile(r'[1-8]\s*(?:x|串)\s*\d+|单关|单式|单场')
+
+def check_pass_type(pass_type):
+    """Returns: 错误信息 或 None"""
+    if not isinstance(pass_type, str) or not _PASS_TYPE_RE.fullmatch(pass_type):
+        return f"过关方式无效: {pass_type}"
+    return None
+
+def check_multiplier(multiplier):
+    """倍数须为正整数 (字符串或整数)；Returns: 错误信息 或 None"""
+    if not str(multiplier).isdecimal() or int(multiplier) < 1:
+        return f"倍数无效: {multiplier}"
+    return None
+
+def pack_sizes(n, capacity, min_legs=1):
+    """
+    n 注拆成最少张票的每票场次：先按容量装满，零头不足 min_legs 时
+    把它和前面尽量少的几张满票一起均分 (如 7 注 2x1 / 容量 3 -> 3,2,2 而不是 3,3,1)
+    最多并入 capacity - 1 张满票；怎么均分都凑不够时保持定长切片 (只有最后一张不足)，由调用方报告
+    """
+    if n <= 0: return []
+    k = -(-n // capacity)
+    r = n - capacity * (k - 1)
+    for m in range(1, min(k, capacity) + 1):
+        tail = capacity * (m - 1) + r
+        if tail // m >= min_legs: break
+    else:
+        m, tail = 1, r
+    q, extra = divmod(tail, m)
+    return [capacity] * (k - m) + [q + 1] * extra + [q] * (m - extra)
+
+# === 选项码解析器 (由 mappings.json 预编译) ===
+class OptionCodeResolver:
+    """
+    每个 (彩种, 玩法) 预建: 精确匹配字典 + 模糊键正则
+    模糊键按长度降序编译为一个交替正则，一次扫描取最靠左、同位置最长的键，
+    结果与 mappings.json 中键的顺序无关
+    例: "让分主胜[+3.5]" -> "让分主胜"；"2[1.85]" -> "2" (不会被赔率里的 "1" 抢先命中)
+    同一批注单里选项写法高度重复，解析结果按 (彩种, 玩法, 选项) 做 LRU 缓存
+    """
+    def __init__(self, rules, cache_size=65536):
+        self._exact = {}
+        self._fuzzy = {}
+        for category, plays in rules.items():
+            if not isinstance(plays, dict): continue
+            for play_type, play_map in plays.items():
+                # 数字彩的映射是选项列表，选项即代码，不参与解析
+                if not isinstance(play_map, dict): continue
+                key = (category, play_type.upper())
+                self._exact[key] = dict(play_map)
+                keys = sorted((k for k in play_map if k), key=len, reverse=True)
+                if keys:
+                    self._fuzzy[key] = re.compile('|'.join(map(re.escape, keys)))
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, category, play_type, choice):
+        """Returns: 官方选项码；无法解析时原样返回 choice"""
+        key = (category, play_type.upper())
+        exact = self._exact.get(key)
+        if exact is None:
+            return choice
+
+        # 1. 精确匹配
+        code = exact.get(choice)
+        if code is not None:
+            return code
+
+        # 2. 最左最长匹配
+        pattern = self._fuzzy.get(key)
+        m = pattern.search(choice) if pattern else None
+        return exact[m.group()] if m else choice
+
 class SportteryRuleEngine:
     def __init__(self):
         # 1. 加载官方映射表
@@ -25,36 +159,23 @@ class SportteryRuleEngine:
                 print(f"[Logic Warning] mappings.json not found at {config_path}")
         except Exception as e:
             print(f"[Logic Error] Failed to load mappings: {e}")
+        self.resolver = OptionCodeResolver(self.rules)
         
-        # 2. 星期映射表 (Rule 2956 核心: 1=周一 ... 7=周日)
-        self.week_map = {
-            '周一': '1', '周二': '2', '周三': '3', '周四': '4', 
-            '周五': '5', '周六': '6', '周日': '7'
-        }
+        # 2. 星期映射表 (见模块级 WEEK_MAP)
+        self.week_map = WEEK_MAP
+        self._titles = {}
+        # 各玩法 OMR 模板的容量 / 可选过关方式 (register_templates 登记)，拆单时据此选最大可用容量
+        self.template_caps = {}
 
     def normalize_match_id(self, raw_text, category="football"):
-        """
-        场次清洗引擎: 将人类可读场次转换为机器码
-        Input: "周三305" -> Output: "3305"
-        """
-        if category == "number": 
-            # 数字彩提取纯数字期号
-            digits = re.findall(r'\d+', raw_text)
-            return digits[0] if digits else raw_text
-            
-        # 竞彩提取 (周x + 数字)
-        for cn, num in self.week_map.items():
-            if cn in raw_text:
-                digits = re.findall(r'\d+', raw_text)
-                if digits: 
-                    # 补齐3位，例如: 周三1 -> 3001, 周三305 -> 3305
-                    return f"{num}{digits[0].zfill(3)}"
-        
-        # 兜底：如果输入已经是纯数字 (3305)
-        if re.match(r'^\d{4,5}$', raw_text):
-            return raw_text
-            
-        return raw_text
+        """场次清洗: "周三305" -> "3305" (见模块级 normalize_match_id)"""
+        return normalize_match_id(raw_text, category)
+
+    def get_category(self, play_type):
+        """根据玩法识别彩种"""
+        if play_type in ["SF","RFSF","SFC","DXF"]: return "basketball"
+        if play_type in ["P3","P5","DLT"]: return "number"
+        return "football"
 
     def get_code(self, category, play_type, choice):
         """
@@ -62,21 +183,10 @@ class SportteryRuleEngine:
         """
         if category == "number":
             return choice # 数字彩选项即代码
-            
-        play_map = self.rules.get(category, {}).get(play_type.upper(), {})
-        
-        # 1. 精确匹配
-        if choice in play_map: 
-            return play_map[choice]
-            
-        # 2. 模糊匹配 (如 "主胜[1.5]" -> 匹配 "主胜")
-        for key, val in play_map.items():
-            if key in choice:
-                return val
-                
-        # 3. 容错: 如果没找到映射但看起来像合法代码(如胜分差的"01","11")
-        # 则直接返回，交给后续 OMR 引擎去处理
-        return choice
+
+        # 精确匹配 -> 最长模糊匹配 (如 "主胜[1.5]" -> "主胜")
+        # 容错: 都没命中但看起来像合法代码 (如胜分差的 "01","11") 则原样返回，交给 OMR 引擎处理
+        return self.resolver.resolve(category, play_type, choice)
 
     def determine_capacity(self, bets, pass_type):
         """
@@ -126,74 +236,215 @@ class SportteryRuleEngine:
             
         return f"{sport_name}{play_name}游戏{suffix}"
 
+    def _title(self, category, play_type, capacity):
+        key = (category, play_type, capacity)
+        title = self._titles.get(key)
+        if title is None:
+            title = self._titles[key] = self.generate_title(category, play_type, capacity)
+        return title
+
     def generate_ticket_data(self, bets, pass_type, multiplier):
         """
         主处理流程：接收前端数据 -> 拆单 -> 生成打印数据列表
+        与 generate_ticket_data_bulk 共用分组拆单，直接读注单字典 (不先转成列)
+        """
+        if not bets: return {"tickets": [], "count": 0, "groups": [], "saved": 0}
+        # 分组 (玩法唯一确定彩种)；单一玩法的订单 (最常见) 不建索引
+        first = bets[0]['type']
+        if all(b['type'] == first for b in bets):
+            index = {first: None}
+        else:
+            index = {}
+            for i, b in enumerate(bets):
+                index.setdefault(b['type'], []).append(i)
+        pick = itemgetter('match', 'choice')
+        return self._generate_groups(
+            index, len(bets),
+            lambda rows: map(pick, bets) if rows is None else (pick(bets[i]) for i in rows),
+            pass_type, multiplier
+        )
+
+    def generate_ticket_data_bulk(self, matches, types, choices, pass_type, multiplier):
         """
-        if not bets: return {"tickets": [], "count": 0}
+        列式批量出票 (大批量导入用)：matches / types / choices 为等长数组，每注一行
+        结果与 generate_ticket_data 对同一批注单的输出完全一致
+        """
+        n = len(matches)
+        if not n: return {"tickets": [], "count": 0, "groups": [], "saved": 0}
+        if len(types) != n or len(choices) != n:
+            raise ValueError("matches / types / choices 长度不一致")
+        if len(set(types)) == 1:
+            index = {types[0]: None}
+        else:
+            index = {}
+            for i, t in enumerate(types):
+                index.setdefault(t, []).append(i)
+        return self._generate_groups(
+            index, n,
+            lambda rows: zip(matches, choices) if rows is None else ((matches[i], choices[i]) for i in rows),
+            pass_type, multiplier
+        )
 
-        # 1. 识别彩种 (假设同一批次彩种一致)
-        first_bet = bets[0]
-        cat = "football"
-        if first_bet['type'] in ["SF","RFSF","SFC","DXF"]: cat = "basketball"
-        if first_bet['type'] in ["P3","P5","DLT"]: cat = "number"
+    def _generate_groups(self, index, n, group_pairs, pass_type, multiplier):
+        """
+        分组拆单 (整单 / 列式共用)
+        index: {玩法: 该组各注在整单中的位置 (None 表示整单都是这个玩法)}，按玩法首次出现的顺序
+        group_pairs(rows): 该组每注的 (场次, 选项)
+        混合订单 (足球 / 篮球 / 数字彩、不同玩法) 各组按 pack_sizes 拆成最少张票；
+        出票顺序与 iter_ticket_data 一致，groups 中报告相对旧版定长切片省下的票数
+        """
+        qr_tail = f"|{pass_type}|{multiplier}"
+        groups, parts = [], []
+        for play_type, rows in index.items():
+            cat = self.get_category(play_type)
+            size = n if rows is None else len(rows)
+            limit, min_legs = self.group_limits(cat, play_type, pass_type)
+            part, info = self._group_tickets(cat, play_type, limit, min_legs, group_pairs(rows), size, rows, qr_tail)
+            # 旧版: determine_capacity 定长切片
+            naive_limit = 5 if cat == "number" else self.determine_capacity(None, pass_type)
+            naive = -(-size // naive_limit)
+            groups.append(dict(info, category=cat, play_type=play_type, capacity=limit, min_legs=min_legs,
+                               tickets=len(part), naive_tickets=naive, saved=naive - len(part)))
+            parts.append(part)
 
-        # 2. 决定单张票容量 (3场 or 6场)
-        if cat == "number":
-            limit = 5 # 数字彩假设一张打5注
+        # 各组内已按出票顺序排好，归并成整单顺序
+        if len(parts) == 1:
+            final_tickets = [t for _, t in parts[0]]
         else:
-            limit = self.determine_capacity(bets, pass_type)
+            final_tickets = [t for _, t in heapq.merge(*parts, key=lambda p: p[0])]
 
-        # 3. 执行拆单 (Chunking)
-        # 将 bets 列表切分为 [[bet1, bet2, bet3], [bet4...]]
-        ticket_chunks = [bets[i:i + limit] for i in range(0, len(bets), limit)]
-        
-        final_tickets = []
-        
-        for chunk in ticket_chunks:
-            human_readable = []
-            machine_codes = []
-            
-            # 处理单张票内的每一行
-            for b in chunk:
-                # 数据归一化
-                m_id = self.normalize_match_id(b['match'], cat)
-                o_code = self.get_code(cat, b['type'], b['choice'])
-                
-                if not o_code and cat != "number": continue
-                
-                # 构建人类可读数据 (传给 driver/engine 绘图用)
-                human_readable.append({
-                    "match_raw": b['match'],      # 原始: "周三305"
-                    "match_code": m_id,           # 机器: "3305"
-                    "type": b['type'],            # "RFSF"
-                    "choice": b['choice'],        # "主胜"
-                    "machine_choice": o_code      # "3"
-                })
-                
-                # 机器码 (用于生成二维码)
-                machine_codes.append(f"{m_id}-{o_code}")
-
-            if not human_readable: continue
-
-            # 生成该张票的标题
-            title = self.generate_title(cat, chunk[0]['type'], limit)
-            
-            # 生成该张票的二维码字符串
-            qr_str = ",".join(machine_codes) + f"|{pass_type}|{multiplier}"
-
-            final_tickets.append({
-                "title": title,
-                "human_readable": human_readable,
-                "machine_qr": qr_str,
-                "meta": {
-                    "category": cat,
-                    "play_type": chunk[0]['type'],
-                    "capacity": limit # 告诉 OMR 引擎用哪个模板 (3或6)
-                }
+        return {
+            "tickets": final_tickets,
+            "count": len(final_tickets),
+            "groups": groups,
+            "saved": sum(g["saved"] for g in groups)
+        }
+
+    def register_templates(self, capacities):
+        """登记各玩法 OMR 模板的容量和底部可选过关方式: {玩法: {容量: {过关方式, ...}}}"""
+        self.template_caps = {pt: {cap: frozenset(passes) for cap, passes in caps.items()}
+                              for pt, caps in capacities.items()}
+
+    def group_limits(self, category, play_type, pass_type):
+        """
+        每组 (彩种, 玩法) 的单票容量和最少场次
+        有 OMR 模板的玩法取底部印有该过关方式的最大模板 (如单关可用 6 关卡)，否则按 determine_capacity
+        """
+        if category == "number":
+            return 5, 1 # 数字彩假设一张打5注
+        legs = pass_legs(pass_type)
+        mark = pass_mark(pass_type)
+        fits = [cap for cap, passes in self.template_caps.get(play_type, {}).items() if mark in passes and cap >= legs]
+        return (max(fits) if fits else self.determine_capacity(None, pass_type)), legs
+
+    def _group_tickets(self, cat, play_type, limit, min_legs, pairs, size, rows, qr_tail):
+        """
+        单一 (彩种, 玩法) 分组的拆单：pairs 为本组 size 注的 (场次, 选项)，
+        rows 为它们在整单中的位置 (None 表示整单即本组)
+        Returns: ([(出票顺序键, 票面记录), ...], 统计)
+        """
+        # 组内玩法相同，选项码按选项去重后解析一次；无法取码的行不占票位 (数字彩除外)
+        code_of = {}
+        keep_all = cat == "number"
+        records, qr_codes, order = [], [], []
+        for pos, (m, c) in enumerate(pairs):
+            o = code_of.get(c)
+            if o is None:
+                o = code_of[c] = self.get_code(cat, play_type, c)
+            if not o and not keep_all: continue
+            m_id = normalize_match_id(m, cat)
+            # 构建人类可读数据 (传给 driver/engine 绘图用)，切块时直接切片
+            records.append({
+                "match_raw": m,          # 原始: "周三305"
+                "match_code": m_id,      # 机器: "3305"
+                "type": play_type,       # "RFSF"
+                "choice": c,             # "主胜"
+                "machine_choice": o      # "3"
             })
+            qr_codes.append(f"{m_id}-{o}")
+            order.append(pos if rows is None else rows[pos])
+        n = len(records)
+        stats = {"bets": n, "skipped": size - n, "short": 0}
+        if not n: return [], stats
+
+        # 出票顺序键 (与 iter_ticket_data 一致)：第 i 张满票在第 i + hold 张满票凑齐时放出，
+        # 其余 (待均分的尾部) 在订单结束时按本组最后一注的位置依次放出
+        hold = limit - 1 if min_legs > 1 else 0
+        full = n // limit
+        tickets = []
+        s = 0
+        for i, size in enumerate(pack_sizes(n, limit, min_legs)):
+            e = s + size
+            if i + hold < full:
+                key = (0, order[(i + hold + 1) * limit - 1])
+            else:
+                key = (1, order[-1], i)
+            if size < min_legs: stats["short"] += 1
+            tickets.append((key, self._make_ticket(cat, limit, play_type, records[s:e], qr_codes[s:e], qr_tail)))
+            s = e
+        return tickets, stats
+
+    def iter_ticket_data(self, bets, pass_type, multiplier):
+        """
+        流式拆单：边读边出票，与 generate_ticket_data()["tickets"] 逐项一致
+        bets 可以是任意可迭代对象 (如逐行读取的导入文件)；
+        每个 (彩种, 玩法) 只缓存一张未满的票和至多 capacity - 1 张待均分的满票，内存与订单大小无关
+        """
+        qr_tail = f"|{pass_type}|{multiplier}"
+        open_groups = {}  # play_type -> 分组状态
+
+        for i, b in enumerate(bets):
+            g = open_groups.get(b['type'])
+            if g is None:
+                cat = self.get_category(b['type'])
+                limit, min_legs = self.group_limits(cat, b['type'], pass_type)
+                g = open_groups[b['type']] = {"cat": cat, "limit": limit, "min_legs": min_legs,
+                                              "hold": limit - 1 if min_legs > 1 else 0,
+                                              "chunk": [], "held": [], "last": i}
+            row = self._ticket_row(g["cat"], b)
+            if row is None: continue
+            g["chunk"].append(row)
+            g["last"] = i
+            if len(g["chunk"]) == g["limit"]:
+                g["held"].append(g["chunk"])
+                g["chunk"] = []
+                if len(g["held"]) > g["hold"]:
+                    yield self._rows_ticket(g, g["held"].pop(0), qr_tail)
+
+        # 订单结束：各组剩余的票 (含待均分的尾部) 按本组最后一注的位置依次出票
+        for g in sorted(open_groups.values(), key=lambda g: g["last"]):
+            rest = [row for chunk in g["held"] for row in chunk] + g["chunk"]
+            s = 0
+            for size in pack_sizes(len(rest), g["limit"], g["min_legs"]):
+                yield self._rows_ticket(g, rest[s:s + size], qr_tail)
+                s += size
 
+    def _ticket_row(self, cat, b):
+        """单注 -> (人类可读行, 二维码片段)；无法取码时返回 None (数字彩除外)"""
+        m_id = normalize_match_id(b['match'], cat)
+        o_code = self.get_code(cat, b['type'], b['choice'])
+        if not o_code and cat != "number": return None
         return {
-            "tickets": final_tickets,
-            "count": len(final_tickets)
+            "match_raw": b['match'],
+            "match_code": m_id,
+            "type": b['type'],
+            "choice": b['choice'],
+            "machine_choice": o_code
+        }, f"{m_id}-{o_code}"
+
+    def _rows_ticket(self, g, rows, qr_tail):
+        return self._make_ticket(g["cat"], g["limit"], rows[0][0]['type'], [r[0] for r in rows], [r[1] for r in rows], qr_tail)
+
+    def _make_ticket(self, cat, limit, play_type, human_readable, machine_codes, qr_tail):
+        """单张票面记录 (整单 / 流式共用)"""
+        return {
+            "title": self._title(cat, play_type, limit),
+            "human_readable": human_readable,
+            # 该张票的二维码字符串
+            "machine_qr": ",".join(machine_codes) + qr_tail,
+            "meta": {
+                "category": cat,
+                "play_type": play_type,
+                "capacity": limit # 告诉 OMR 引擎用哪个模板 (3或6)
+            }
         }
@@ -4,12 +4,36 @@ import sys
 import json
 import datetime
 import threading
+import itertools
+import tempfile
+import multiprocessing
+import base64
+import zlib
+from io import BytesIO
 import webview
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from driver import EscPosDriver
+from print_queue import PrintQueue
+from logic import SportteryRuleEngine, normalize_match_id, check_multiplier, check_pass_type
+from render_pool import RenderService
+from omr_engine import OMREngine
+from cache_store import LRUCache, DiskCache, TieredCache
+from templates.parser import BatchParser
+from order_import import OrderImporter, ImportProgress
+from ocr_adapter import UmiOCRClient
+from ocr_batch import OCRBatchService
+try:
+    from ocr_service import OCRService
+except ImportError:
+    # 本地 PaddleOCR 引擎依赖 opencv / numpy，未安装时只用 Umi-OCR
+    OCRService = None
+from PIL import Image
 
 # === 配置: 目标打印机名称 ===
 # 用户需在 Windows 控制面板确认此名称
 PRINTER_NAME = "XP-58"
+# 光栅票使用紧凑模式 (空白行走纸，只传有墨条带)
+COMPACT_RASTER = True
 
 def resource_path(relative_path):
     """资源路径修正：兼容开发环境与打包后的 exe 环境"""
@@ -17,7 +41,50 @@ def resource_path(relative_path):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
+def data_path(relative_path):
+    """可写数据路径：打包后放在 exe 同级目录 (_MEIPASS 是临时解压目录，退出即删)"""
+    base_dir = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.abspath(".")
+    return os.path.join(base_dir, relative_path)
+
 app = Flask(__name__, template_folder=resource_path('templates'))
+# 拍照识别：线程数 = Umi-OCR 连接池大小，批量照片并发送入引擎
+OCR_WORKERS = 4
+
+# === 应用状态：只在主进程里由 init_app() 构建 ===
+# Windows spawn / 打包版本下，渲染 / 解析 / OCR 进程池的子进程会重新导入 __main__；
+# 放在模块级会让每个子进程都重新加载模板、扫描磁盘缓存目录 (甚至淘汰共享目录里的文件)
+driver = print_queue = rule_engine = omr_engine = None
+card_cache = render_service = batch_parser = order_importer = None
+ocr_cache = ocr_client = ocr_service = local_ocr = None
+import_jobs = LRUCache(max_items=100)
+import_ids = itertools.count(1)
+# 增量预览：每个前端会话保留上一张卡面
+preview_sessions = LRUCache(max_items=64, max_bytes=16 * 1024 * 1024)
+
+def init_app():
+    global driver, print_queue, rule_engine, omr_engine, card_cache, render_service, batch_parser, order_importer
+    global ocr_cache, ocr_client, ocr_service, local_ocr
+    driver = EscPosDriver()
+    print_queue = PrintQueue(driver)
+    rule_engine = SportteryRuleEngine()
+    # 卡面缓存：按规范化卡面哈希缓存光栅和预览 PNG (重打 / 预览未变化时直接命中)
+    card_cache = LRUCache(max_items=1024, max_bytes=64 * 1024 * 1024)
+    render_service = RenderService(compact_raster=COMPACT_RASTER, cache=card_cache)
+    omr_engine = OMREngine()
+    # 拆单按模板底部印有的过关方式选最大可用容量 (如单关用 6 关卡)
+    rule_engine.register_templates(omr_engine.template_capacities())
+    # 批量文本导入 (大文本按块分发到进程池解析)
+    batch_parser = BatchParser(rule_engine)
+    # 订单文件导入 (CSV / XLSX)，进度按导入号查询
+    order_importer = OrderImporter(rule_engine)
+    # 识别结果缓存：按图片内容哈希，内存一级 + 磁盘一级 (重启后重复上传仍命中)
+    ocr_cache = TieredCache(LRUCache(max_items=256, max_bytes=16 * 1024 * 1024),
+                            DiskCache(data_path("ocr_cache"), max_items=5000, max_bytes=128 * 1024 * 1024))
+    ocr_client = UmiOCRClient(pool_size=OCR_WORKERS, cache=ocr_cache)
+    ocr_service = OCRBatchService(ocr_client, workers=OCR_WORKERS)
+    # 本地 PaddleOCR 引擎池：启动时后台预热，进程数按核数
+    local_ocr = OCRService(cache=ocr_cache) if OCRService else None
+    return app
 
 # === 核心业务逻辑 ===
 RULES = {
@@ -31,28 +98,9 @@ RULES = {
     }
 }
 
-def normalize_match(raw_id):
-    week_map = {'周一':'1', '周二':'2', '周三':'3', '周四':'4', '周五':'5', '周六':'6', '周日':'7'}
-    for k, v in week_map.items():
-        if k in raw_id:
-            return v + raw_id.replace(k, '').strip()
-    return raw_id
-
 def send_raw_printer(printer_name, data_bytes):
-    try:
-        import win32print
-        p = win32print.OpenPrinter(printer_name)
-        try:
-            job = win32print.StartDocPrinter(p, 1, ("PrintBet Job", None, "RAW"))
-            win32print.StartPagePrinter(p)
-            win32print.WritePrinter(p, data_bytes)
-            win32print.EndPagePrinter(p)
-            win32print.EndDocPrinter(p)
-            return True
-        finally:
-            win32print.ClosePrinter(p)
-    except Exception as e:
-        return False
+    # 打印机句柄由 driver 的会话池常驻复用
+    return driver.send_raw(printer_name, data_bytes)
 
 def build_escpos(bets, pass_type, multi, qr_str):
     cmds = []
@@ -69,7 +117,7 @@ def build_escpos(bets, pass_type, multi, qr_str):
     cmds.append(f"PASS: {pass_type}  MULTI: {multi}\n".encode('gbk'))
     
     # QR Code Logic
-    cmds.append(b'\n\x1B\x61\x01Scan to Terminal:\n'.encode('gbk'))
+    cmds.append(b'\n\x1B\x61\x01Scan to Terminal:\n')
     q_bytes = qr_str.encode('utf-8')
     l = len(q_bytes) + 3
     pl, ph = l % 256, l // 256
@@ -89,22 +137,308 @@ def handle_print():
     d = request.json
     codes = []
     for b in d['bets']:
-        m = normalize_match(b['match'])
+        m = normalize_match_id(b['match'])
         pmap = RULES.get(b['type'], RULES['SPF'])
         o = pmap.get(b['choice'], b['choice'])
         codes.append(f"{m}-{o}")
     
     qr = ",".join(codes) + f"|{d['passType']}|{d['multiplier']}"
-    data = build_escpos(d['bets'], d['passType'], d['multiplier'], qr)
-    
-    if send_raw_printer(PRINTER_NAME, data):
-        return jsonify({"status": "ok", "qr": qr})
-    return jsonify({"status": "error", "msg": f"Printer '{PRINTER_NAME}' not found or offline."})
+    # 渲染和假脱机都在打印线程中执行，接口立即返回作业号
+    job = print_queue.submit(PRINTER_NAME, [lambda: build_escpos(d['bets'], d['passType'], d['multiplier'], qr)])
+    return jsonify({"status": "ok", "qr": qr, "job_id": job.id})
+
+@app.route('/api/print/batch', methods=['POST'])
+def handle_print_batch():
+    """整单出票：按 (彩种, 玩法) 分组拆单 -> 进程池并行渲染 -> 合并为一个假脱机作业 (每张票自带切纸)"""
+    d = request.json
+    msg = check_multiplier(d['multiplier'])
+    if msg:
+        return jsonify({"status": "error", "msg": msg}), 400
+    result = rule_engine.generate_ticket_data(d['bets'], d['passType'], d['multiplier'])
+    if not result['tickets']:
+        return jsonify({"status": "error", "msg": "没有可出票的投注"})
+    # 出票前逐张校验 (如场次无法涂写到答题卡)，有问题整单不出，逐张报告
+    checks = [(i, t, omr_engine.check_ticket(t, d['passType'])) for i, t in enumerate(result['tickets'])]
+    errors = [{"ticket": i, "qr": t['machine_qr'], "msg": msg} for i, t, msg in checks if msg]
+    if errors:
+        return jsonify({"status": "error", "msg": errors[0]['msg'], "errors": errors}), 400
+
+    chunks = render_service.render_commands(result['tickets'], d['passType'], d['multiplier'])
+    job = print_queue.submit(PRINTER_NAME, chunks, batch=True)
+    return jsonify({
+        "status": "ok",
+        "job_id": job.id,
+        "count": result['count'],
+        "groups": result['groups'],
+        "bytes": sum(len(c) for c in chunks),
+        "qr": [t['machine_qr'] for t in result['tickets']]
+    })
+
+def with_machine_codes(bets):
+    return [dict(b, machine_choice=rule_engine.get_code(rule_engine.get_category(b['type']), b['type'], b['choice']))
+            for b in bets]
+
+def card_capacity(play_type, pass_type):
+    """预览与出票用同一张卡：容量按拆单规划 (group_limits) 取，与票的 meta.capacity 一致"""
+    return rule_engine.group_limits(rule_engine.get_category(play_type), play_type, pass_type)[0]
+
+def store_card_bits(key, width, height, bits):
+    """登记卡面打包位 (1=黑)，供 GET /api/omr/<hash> 按需取用"""
+    if card_cache.get(("bits", key)) is None:
+        card_cache.put(("bits", key), (width, height, bytes(bits)), len(bits))
+
+@app.route('/api/preview_omr', methods=['POST'])
+def preview_omr():
+    """只返回卡面哈希和地址，图片本身由可缓存的 GET 接口输出"""
+    d = request.json
+    bets = with_machine_codes(d['bets'])
+    play_type = bets[0]['type'] if bets else "SF"
+    capacity = card_capacity(play_type, d['passType'])
+    msg = omr_engine.check_bets(bets, d['passType'], d['multiplier'], play_type, capacity)
+    if msg:
+        return jsonify({"status": "error", "msg": msg}), 400
+
+    key = omr_engine.card_key(bets, d['passType'], d['multiplier'], play_type, capacity)
+    if not key:
+        return jsonify({"status": "ok", "empty": True})
+    if card_cache.get(("bits", key)) is None:
+        x_bytes, height, data = omr_engine.dispatch_raster(bets, d['passType'], d['multiplier'], play_type, capacity)
+        store_card_bits(key, x_bytes * 8, height, data)
+    return jsonify({"status": "ok", "hash": key, "url": f"/api/omr/{key}.png", "raw_url": f"/api/omr/{key}.bin"})
+
+@app.route('/api/omr/<key>.<fmt>', methods=['GET'])
+def get_omr_card(key, fmt):
+    """
+    按卡面哈希输出 1-bit 卡面 (内容寻址，ETag 即哈希)
+    .png: 1-bit PNG (快速压缩)，可直接用于 <img>
+    .bin: 打包位 (1=黑，每行 width/8 字节)，客户端支持时以 deflate 传输
+          两种传输编码的字节不同，各用一个 ETag (deflate 加 "-z") 并声明 Vary，缓存不会串用
+    """
+    if fmt not in ("png", "bin"):
+        return jsonify({"status": "error", "msg": "不支持的格式"}), 404
+    deflate = fmt == "bin" and "deflate" in request.accept_encodings
+    etag = f"{key}.{fmt}-z" if deflate else f"{key}.{fmt}"
+    headers = {"Cache-Control": "public, max-age=86400, immutable"}
+    if fmt == "bin":
+        headers["Vary"] = "Accept-Encoding"
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304, headers=headers)
+        resp.set_etag(etag)
+        return resp
+
+    card = card_cache.get(("bits", key))
+    if card is None:
+        return jsonify({"status": "error", "msg": "卡面已过期，请重新预览"}), 404
+    width, height, bits = card
+
+    if fmt == "png":
+        body = card_cache.get(("png", key))
+        if body is None:
+            buf = BytesIO()
+            Image.frombytes('1', (width, height), bits, 'raw', '1;I').save(buf, format="PNG", compress_level=1)
+            body = buf.getvalue()
+            card_cache.put(("png", key), body)
+        resp = Response(body, mimetype="image/png", headers=headers)
+    else:
+        headers.update({"X-Card-Width": str(width), "X-Card-Height": str(height)})
+        if deflate:
+            body = card_cache.get(("deflate", key))
+            if body is None:
+                body = zlib.compress(bits, 1)
+                card_cache.put(("deflate", key), body)
+            headers["Content-Encoding"] = "deflate"
+        else:
+            body = bits
+        resp = Response(body, mimetype="application/octet-stream", headers=headers)
+    resp.set_etag(etag)
+    return resp
+
+@app.route('/api/preview_omr/incremental', methods=['POST'])
+def preview_omr_incremental():
+    """
+    增量预览：与该会话上一张卡面比较，只回传变化的栏位 / 底部区域
+    补丁为打包 1-bit (1=黑)，zlib 快速压缩后 base64；
+    整卡重绘 (full=True) 时不内联数据，而是给出可被浏览器缓存的 GET 地址
+    seq / base: 本次请求序号 / 客户端画布当前对应的序号；与会话里记录的不一致时 (响应丢失、乱序) 整卡重绘
+    """
+    d = request.json
+    sid = d.get('session') or 'default'
+    bets = with_machine_codes(d['bets'])
+    play_type = bets[0]['type'] if bets else "SF"
+    capacity = card_capacity(play_type, d['passType'])
+    msg = omr_engine.check_bets(bets, d['passType'], d['multiplier'], play_type, capacity)
+    if msg:
+        return jsonify({"status": "error", "msg": msg}), 400
+
+    prev = preview_sessions.get(sid)
+    if prev is not None and prev.get('seq') != d.get('base'):
+        prev = None
+    state, dirty = omr_engine.render_incremental(prev, bets, d['passType'], d['multiplier'], play_type, capacity)
+    if state is None:
+        return jsonify({"status": "ok", "empty": True})
+    state['seq'] = d.get('seq')
+    preview_sessions.put(sid, state, len(state['buf']))
+
+    (w, h), buf = state['size'], state['buf']
+    if dirty is None:
+        key = omr_engine.card_key(bets, d['passType'], d['multiplier'], play_type, capacity)
+        store_card_bits(key, w, h, buf)
+        return jsonify({"status": "ok", "full": True, "seq": state['seq'], "width": w, "height": h,
+                        "url": f"/api/omr/{key}.bin"})
+
+    stride = (w + 7) // 8
+    patches = []
+    for x0, y0, x1, y1 in dirty:
+        b0, b1 = x0 >> 3, (x1 >> 3) + 1
+        bits = b''.join(buf[off + b0:off + b1] for off in range(y0 * stride, (y1 + 1) * stride, stride))
+        patches.append({"x": x0, "y": y0, "w": x1 - x0 + 1, "h": y1 - y0 + 1,
+                        "bits": base64.b64encode(zlib.compress(bits, 1)).decode()})
+    return jsonify({"status": "ok", "full": False, "seq": state['seq'], "width": w, "height": h, "patches": patches})
+
+@app.route('/api/batch/parse', methods=['POST'])
+def batch_parse():
+    """
+    批量文本导入：上传文件 (file)、JSON {"text": ...} 或原始请求体，逐行流式解析
+    以 NDJSON 逐条返回 {"line", "ticket"} / {"line", "error"}，最后一行为汇总 {"done": true, ...}
+    """
+    def generate():
+        # 在流式响应内取数据源：上传文件要在整个响应期间保持打开
+        if 'file' in request.files:
+            source = request.files['file'].stream
+        elif request.is_json:
+            source = request.json.get('text', '')
+        else:
+            source = request.stream
+        delimiter = request.args.get('delimiter') or request.form.get('delimiter')
+        tickets = errors = 0
+        for result in batch_parser.parse_stream(source, delimiter):
+            if "error" in result: errors += 1
+            else: tickets += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "tickets": tickets, "errors": errors}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route('/api/import', methods=['POST'])
+def import_orders():
+    """
+    订单文件导入 (CSV / XLSX)：上传文件分块落盘后，由打印线程逐行 读取 -> 校验 -> 拆单 -> 渲染 -> 出票
+    表单参数: passType, multiplier, dry_run=1 (只校验不出票)
+    """
+    f = request.files.get('file')
+    if not f:
+        return jsonify({"status": "error", "msg": "缺少导入文件"}), 400
+    pass_type = request.form.get('passType', '1x1')
+    multiplier = request.form.get('multiplier', '1')
+    msg = check_pass_type(pass_type) or check_multiplier(multiplier)
+    if msg:
+        return jsonify({"status": "error", "msg": msg}), 400
+    suffix = os.path.splitext(f.filename or "")[1].lower() or ".csv"
+    fd, path = tempfile.mkstemp(prefix="import_", suffix=suffix)
+    with os.fdopen(fd, 'wb') as out:
+        f.save(out)
+
+    import_id = f"{int(datetime.datetime.now().timestamp())}-{next(import_ids)}"
+    progress = ImportProgress(f.filename or os.path.basename(path))
+    import_jobs.put(import_id, progress, 1)
+
+    if request.form.get('dry_run') in ('1', 'true'):
+        def validate():
+            try: order_importer.validate_file(path, progress)
+            finally: os.remove(path)
+        threading.Thread(target=validate, daemon=True).start()
+    else:
+        def tickets():
+            # 打印线程逐张取用：读一行、拆一张、渲染一张、出一张
+            try:
+                for t in order_importer.iter_tickets(path, pass_type, multiplier, progress,
+                                                     check=lambda t: omr_engine.check_ticket(t, pass_type)):
+                    yield render_service.render_commands([t], pass_type, multiplier)[0]
+            finally:
+                os.remove(path)
+        progress.job_id = print_queue.submit(PRINTER_NAME, tickets()).id
+    return jsonify({"status": "ok", "import_id": import_id, "job_id": progress.job_id})
+
+@app.route('/api/import/<import_id>', methods=['GET'])
+def get_import(import_id):
+    progress = import_jobs.get(import_id)
+    if progress is None:
+        return jsonify({"status": "error", "msg": "导入记录不存在"}), 404
+    result = progress.to_dict()
+    if progress.job_id:
+        result["job"] = print_queue.get(progress.job_id)
+    return jsonify({"status": "ok", "import": result})
+
+@app.route('/api/ocr', methods=['POST'])
+def ocr_single():
+    """单张拍照识别 (表单字段 image)；engine=local 时用本地 PaddleOCR 引擎池"""
+    f = request.files.get('image')
+    if not f:
+        return jsonify({"status": "error", "msg": "缺少图片"}), 400
+    if (request.args.get('engine') or request.form.get('engine')) == 'local':
+        if local_ocr is None:
+            return jsonify({"status": "error", "msg": "本地 OCR 引擎未安装 (需要 opencv / paddleocr)"}), 503
+        return jsonify(local_ocr.parse_image(f.read()))
+    return jsonify(ocr_service.process(f.read()))
+
+@app.route('/api/ocr/status', methods=['GET'])
+def ocr_status():
+    """识别引擎就绪状态：Umi-OCR 是否在线 + 本地引擎池预热进度 / 耗时"""
+    return jsonify({
+        "status": "ok",
+        "umi": {"online": ocr_client.check_connection(), "url": ocr_client.url, **ocr_client.stats()},
+        "local": local_ocr.status() if local_ocr else {"state": "unavailable", "ready": False}
+    })
+
+@app.route('/api/ocr/batch', methods=['POST'])
+def ocr_batch():
+    """
+    批量拍照识别：表单字段 images 可传多张，OCR 线程池并发处理
+    以 NDJSON 按完成先后逐张返回 {"index", "name", "status", "bets", ...}，最后一行为汇总 {"done": true, ...}
+    """
+    def generate():
+        files = request.files.getlist('images') or request.files.getlist('image')
+        ok = failed = bets = 0
+        # 图片在工作线程里才读出，同时在内存里的只有在途的几张
+        for result in ocr_service.iter_batch((f.filename, f.read) for f in files):
+            if result["status"] == "ok":
+                ok += 1
+                bets += len(result["bets"])
+            else:
+                failed += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "images": ok + failed, "ok": ok, "failed": failed, "bets": bets,
+                          "ocr": ocr_client.stats()}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"status": "ok", "omr": card_cache.stats(), "ocr": ocr_cache.stats()})
+
+@app.route('/api/print/jobs', methods=['GET'])
+def list_print_jobs():
+    return jsonify({"status": "ok", "jobs": print_queue.list_jobs()})
+
+@app.route('/api/print/jobs/<job_id>', methods=['GET'])
+def get_print_job(job_id):
+    job = print_queue.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "msg": "作业不存在"}), 404
+    return jsonify({"status": "ok", "job": job})
 
 def start_server():
     app.run(host='127.0.0.1', port=18888, use_reloader=False)
 
 if __name__ == '__main__':
+    # PyInstaller 打包后进程池子进程需要
+    multiprocessing.freeze_support()
+    init_app()
+    # 后台预热渲染进程池 (每个进程加载一次 omr_maps)
+    threading.Thread(target=render_service.start, daemon=True).start()
+    # 后台预热本地 OCR 引擎池 (每个进程加载一次模型)，就绪状态见 /api/ocr/status
+    if local_ocr:
+        threading.Thread(target=local_ocr.start, daemon=True).start()
     t = threading.Thread(target=start_server)
     t.daemon = True
     t.start()
@@ -2,52 +2,150 @@
 import requests
 import base64
 import json
+import threading
+import time
+from collections import deque
 from io import BytesIO
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageEnhance, ImageFilter, ImageStat
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache_store import content_hash
 
 class UmiOCRClient:
-    def __init__(self, url="http://127.0.0.1:1224/api/ocr"):
+    """
+    Umi-OCR HTTP 客户端
+    持有一个 keep-alive 连接池的 Session：连续扫描复用同一条 TCP 连接，不再每张图都握手
+    连接失败 / 502-504 按 backoff 退避重试；每次调用的耗时记入 stats()
+    """
+    def __init__(self, url="http://127.0.0.1:1224/api/ocr", connect_timeout=1.0, read_timeout=8.0,
+                 retries=2, backoff=0.2, pool_size=4, history=200,
+                 max_side=1600, contrast_threshold=60, transport="png", cache=None):
         self.url = url
+        # cache: cache_store.LRUCache / TieredCache，按 图片哈希 + 预处理参数 缓存识别结果，重复上传不再走引擎
+        self.cache = cache
+        # 预处理：长边上限 (像素)、跳过对比度增强的灰度标准差阈值、发送格式 ("png" / "jpeg")
+        self.max_side = max_side
+        self.contrast_threshold = contrast_threshold
+        self.transport = transport
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        # 读超时不重试：引擎正忙时重发只会让排队更长
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=backoff,
+                      status_forcelist=(502, 503, 504), allowed_methods=frozenset(["GET", "POST"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # 最近 history 次调用的耗时 (ms)
+        self._latency = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self.calls = self.errors = 0
 
     def update_url(self, new_url):
+        # 连接池按 host 复用，换地址后旧连接自然闲置，不需要重建 Session
         self.url = new_url
 
     def check_connection(self):
+        """探活的同时预热一条 keep-alive 连接，随后的第一张扫描就不再付握手的开销"""
         try:
             target = self.url.replace("/api/ocr", "")
-            requests.get(target, timeout=0.5)
+            self.session.get(target, timeout=(0.5, 0.5)).close()
             return True
         except: return False
 
-    # === 新增：图像增强流水线 ===
-    def _preprocess_image(self, img_bytes):
+    def close(self):
+        self.session.close()
+
+    def _record(self, elapsed_ms, ok):
+        with self._lock:
+            self.calls += 1
+            if not ok: self.errors += 1
+            self._latency.append(elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._latency)
+            calls, errors = self.calls, self.errors
+        pick = lambda q: round(samples[min(len(samples) - 1, int(len(samples) * q))], 1) if samples else 0.0
+        return {
+            "calls": calls,
+            "errors": errors,
+            "samples": len(samples),
+            "avg_ms": round(sum(samples) / len(samples), 1) if samples else 0.0,
+            "p50_ms": pick(0.5),
+            "p95_ms": pick(0.95),
+            "max_ms": round(samples[-1], 1) if samples else 0.0,
+            "timeout": list(self.timeout)
+        }
+
+    # === 图像预处理流水线 ===
+    def preprocess(self, img_bytes):
         """
-        图像增强算法：去噪 -> 锐化 -> 高对比度
-        让 OCR 引擎更容易识别点阵字或模糊字
+        解码一次 -> 缩到目标尺寸 -> 按需增强 -> 灰度无损编码
+        手机拍的 12MP 照片字高远超 OCR 所需，先缩小再增强，后面每一步的像素量都降一个数量级
+        Returns: (bytes, info)  info 记录缩放比例和实际执行的步骤
         """
-        try:
-            img = Image.open(BytesIO(img_bytes))
-            
-            # 1. 转灰度 (消除彩色噪点)
+        img = Image.open(BytesIO(img_bytes))
+        src_size = img.size
+        long_side = max(src_size)
+        info = {"src": list(src_size), "stages": []}
+
+        # 1. JPEG 在 DCT 阶段直接按 1/2、1/4、1/8 解码并只解亮度通道，不先解出全尺寸彩色图
+        if long_side > self.max_side:
+            ratio = self.max_side / long_side
+            img.draft('L', (int(src_size[0] * ratio) + 1, int(src_size[1] * ratio) + 1))
+
+        # 2. 转灰度 (消除彩色噪点)
+        if img.mode != 'L':
             img = img.convert('L')
-            
-            # 2. 增强对比度 (让字更黑，纸更白)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(2.0) # 提高2倍对比度
-            
-            # 3. 增强锐度 (边缘清晰化)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.5)
-            
-            # 4. 转回 Bytes
-            output_buffer = BytesIO()
+
+        # 3. 缩到长边 max_side (先整数倍 reduce 再插值，比直接 resize 快)
+        if max(img.size) > self.max_side:
+            img.thumbnail((self.max_side, self.max_side), Image.BILINEAR, reducing_gap=2.0)
+        scale = max(img.size) / long_side
+        info["size"] = list(img.size)
+
+        # 4. 增强对比度 (让字更黑，纸更白)；直方图标准差已经够大的图跳过
+        if ImageStat.Stat(img).stddev[0] < self.contrast_threshold:
+            img = ImageEnhance.Contrast(img).enhance(2.0)
+            info["stages"].append("contrast")
+
+        # 5. 增强锐度 (边缘清晰化)；缩小一半以上时边缘已经足够锐利
+        #    (全图求边缘统计比锐化本身还贵，这里只按缩放比例判断)
+        if scale > 0.5:
+            img = ImageEnhance.Sharpness(img).enhance(1.5)
+            info["stages"].append("sharpness")
+
+        # 6. 灰度 PNG：无损，低压缩级别编码很快；Umi-OCR 解码也比 JPEG 省
+        output_buffer = BytesIO()
+        if self.transport == "png":
+            img.save(output_buffer, format='PNG', compress_level=1)
+        else:
             img.save(output_buffer, format='JPEG', quality=90)
-            return output_buffer.getvalue()
+        info["format"] = self.transport
+        return output_buffer.getvalue(), info
+
+    def _preprocess_image(self, img_bytes):
+        try:
+            return self.preprocess(img_bytes)[0]
         except Exception as e:
             print(f"[OCR Preprocess Fail] {e}")
             return img_bytes # 失败则返回原图
 
+    def _cache_key(self, img_bytes):
+        return ("umi", content_hash(img_bytes), self.max_side, self.contrast_threshold, self.transport)
+
     def scan(self, img_bytes):
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(img_bytes)
+            hit = self.cache.get(key)
+            if hit is not None:
+                return dict(hit, cached=True)
+
+        start = time.perf_counter()
+        ok = False
         try:
             # 1. 执行预处理
             enhanced_bytes = self._preprocess_image(img_bytes)
@@ -63,7 +161,7 @@ class UmiOCRClient:
                 }
             }
             
-            r = requests.post(self.url, json=payload, timeout=8)
+            r = self.session.post(self.url, json=payload, timeout=self.timeout)
             if r.status_code != 200: 
                 return {"status":"error", "msg":f"HTTP {r.status_code}"}
             
@@ -76,13 +174,23 @@ class UmiOCRClient:
                     total_score = sum([item.get('score', 0) for item in raw_data])
                     avg_score = total_score / len(raw_data)
                 
-                return {
+                ok = True
+                result = {
                     "status": "ok", 
                     "data": raw_data,
                     "confidence": avg_score # 返回置信度 0.0~1.0
                 }
+                if key is not None:
+                    self.cache.put(key, result)
+                return dict(result, elapsed_ms=round((time.perf_counter() - start) * 1000, 1))
             
             return {"status":"error", "msg": f"引擎错误: {j.get('data')}"}
             
+        except requests.exceptions.Timeout:
+            return {"status":"error", "msg": f"OCR 服务响应超时 (> {self.timeout[1]}s)"}
+        except requests.exceptions.ConnectionError as e:
+            return {"status":"error", "msg": f"无法连接 OCR 服务 (已重试): {e}"}
         except Exception as e:
             return {"status":"error", "msg": str(e)}
+        finally:
+            self._record((time.perf_counter() - start) * 1000, ok)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from ocr_parser import SmartBetParser
+
+# === 批量 OCR ===
+class OCRBatchService:
+    """
+    一张照片 = 预处理 -> Umi-OCR -> SmartBetParser；多张照片交给有界线程池并发处理
+    线程数对齐 OCR 引擎的并发能力 (客户端连接池大小)：一张在等引擎时，另一张在做预处理 / 解析
+    """
+    def __init__(self, client, parser=None, workers=4):
+        self.client = client
+        self.parser = parser or SmartBetParser()
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
+
+    def process(self, img_bytes):
+        """
+        单张照片
+        Returns: {"status": "ok", "bets", "warnings", "confidence", "elapsed_ms"} / {"status": "error", "msg"}
+        """
+        start = time.perf_counter()
+        res = self.client.scan(img_bytes)
+        if res.get("status") != "ok":
+            return res
+        bets, warnings = self.parser.parse(res.get("data") or [])
+        if not bets:
+            return {"status": "error", "msg": "未提取到有效投注", "warnings": warnings}
+        return {
+            "status": "ok",
+            "bets": bets,
+            "warnings": warnings,
+            "confidence": res.get("confidence", 0),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+        }
+
+    def _process_named(self, index, name, data):
+        try:
+            if callable(data): data = data()
+            result = self.process(data)
+        except Exception as e:
+            result = {"status": "error", "msg": str(e)}
+        result.update({"index": index, "name": name})
+        return result
+
+    def iter_batch(self, images):
+        """
+        images: (文件名, bytes 或返回 bytes 的函数) 的迭代器；函数形式在工作线程里才读取，
+                同时在途的照片最多 workers * 2 张 (内存有界)
+        按完成先后逐张产出结果 (带 index / name)，不按提交顺序
+        """
+        images = iter(images)
+        pending = set()
+        exhausted = False
+        index = 0
+        while True:
+            while not exhausted and len(pending) < self.workers * 2:
+                item = next(images, None)
+                if item is None:
+                    exhausted = True
+                    break
+                pending.add(self._executor.submit(self._process_named, index, *item))
+                index += 1
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -1,17 +1,47 @@
 # -*- coding: utf-8 -*-
 import cv2
 import numpy as np
+import importlib.util
 import logging
+import os
 import threading
 
-# 只有在真正调用时才加载 Paddle，避免启动卡死
-# 这是一种 "Lazy Loading" 设计模式
+from cache_store import content_hash
+from render_pool import WarmPool
+
+# 每个进程一个 PaddleOCR 实例 (单进程模式下即本进程的单例)
+# 进程池模式由 start() 在后台拉起并预热，不再等第一位顾客触发加载
 PADDLE_INSTANCE = None
 LOCK = threading.Lock()
+# 每个 Paddle 实例的推理线程数；进程数 = 核数 / 该值
+CPU_THREADS_PER_ENGINE = 2
+
+# === 进程池工作进程：启动时加载模型并跑一次空图推理 ===
+_worker_service = None
+
+def _init_worker(cpu_threads):
+    global _worker_service
+    _worker_service = OCRService(workers=1, cpu_threads=cpu_threads)
+    _worker_service.warm()
+
+def _parse_in_worker(image_bytes):
+    return _worker_service._parse_image(image_bytes)
 
-class OCRService:
-    def __init__(self):
-        self.ready = False
+class OCRService(WarmPool):
+    """
+    本地 PaddleOCR 识别
+    workers > 1 时为引擎进程池：每个进程各自加载并预热一份模型，请求由进程池派给空闲进程
+    workers == 1 时在本进程内识别 (进程池的工作进程本身也是这种模式)
+    """
+    label = "OCR"
+    # 模型加载 + 首次推理在慢机器上要几十秒
+    warm_timeout = 300
+
+    def __init__(self, cache=None, workers=None, cpu_threads=CPU_THREADS_PER_ENGINE):
+        super().__init__(workers or max(1, (os.cpu_count() or 1) // cpu_threads))
+        # cache: cache_store.LRUCache / TieredCache，按图片哈希缓存解析结果
+        self.cache = cache
+        self.cpu_threads = cpu_threads
 
     def _get_paddle(self):
         """单例模式懒加载 PaddleOCR"""
@@ -23,10 +53,33 @@ class OCRService:
                 # use_angle_cls=True 矫正手机拍照角度
                 # lang='ch' 支持中文
                 # show_log=False 禁止控制台刷屏
-                PADDLE_INSTANCE = PaddleOCR(use_angle_cls=True, lang='ch', show_log=False)
+                # cpu_threads 限制单实例线程数，多进程时不互相抢核
+                PADDLE_INSTANCE = PaddleOCR(use_angle_cls=True, lang='ch', show_log=False, cpu_threads=self.cpu_threads)
                 print("[OCR] Engine Ready.")
             return PADDLE_INSTANCE
 
+    def warm(self):
+        """加载模型并对一张空白图推理一次 (首次推理要初始化算子，比加载本身还慢)"""
+        ocr = self._get_paddle()
+        ocr.ocr(np.full((64, 256, 3), 255, np.uint8), cls=True)
+        self.ready = True
+
+    # === 引擎池 (启动 / 预热 / 状态见 render_pool.WarmPool) ===
+    def _unavailable(self):
+        # 没有安装 paddleocr 时标记为 unavailable，不启动进程
+        if importlib.util.find_spec("paddleocr") is None:
+            return "未安装 paddleocr"
+        return None
+
+    def _pool_initializer(self):
+        return _init_worker, (self.cpu_threads,)
+
+    def _warm_inline(self):
+        self.warm()
+
+    def status(self):
+        return dict(super().status(), cpu_threads=self.cpu_threads)
+
     def detect_red_selections(self, image_bytes):
         """
         计算机视觉核心：寻找图片中的红色选中块
@@ -63,7 +116,33 @@ class OCRService:
         return img, red_boxes
 
     def parse_image(self, image_bytes):
-        """主入口"""
+        """主入口 (同一张图命中缓存直接返回)"""
+        if self.cache is None:
+            return self._dispatch(image_bytes)
+        key = ("paddle", content_hash(image_bytes))
+        hit = self.cache.get(key)
+        if hit is not None:
+            return dict(hit, cached=True)
+        result = self._dispatch(image_bytes)
+        if result.get("status") == "ok":
+            self.cache.put(key, result)
+        return result
+
+    def _dispatch(self, image_bytes):
+        """有进程池时交给空闲的引擎进程 (预热未完成则排队等待)，否则在本进程识别"""
+        if self.state in ("error", "unavailable"):
+            return {"status": "error", "msg": f"OCR 引擎不可用: {self.error}"}
+        if self._executor is None and self.workers > 1:
+            self.start()
+        executor = self._executor
+        if executor is None:
+            return self._parse_image(image_bytes)
+        try:
+            return executor.submit(_parse_in_worker, image_bytes).result()
+        except Exception as e:
+            return {"status": "error", "msg": str(e)}
+
+    def _parse_image(self, image_bytes):
         try:
             ocr = self._get_paddle()
             img_cv, red_boxes = self.detect_red_selections(image_bytes)
@@ -1,16 +1,62 @@
 # -*- coding: utf-8 -*-
 from PIL import Image, ImageDraw
+from collections import namedtuple
+from types import MappingProxyType
+import hashlib
 import json
 import os
 import sys
 
+from logic import card_match_parts, check_multiplier, pass_mark
+
 def resource_path(relative_path):
     if hasattr(sys, '_MEIPASS'):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
+# === 预编译版面 (Layout Plan) ===
+# 模板 JSON 在加载时一次性展开为扁平、只读的坐标表，出票时只做查表 + 填块。
+# 所有 box 均为 PIL rectangle 的闭区间坐标 (x0, y0, x1, y1)。
+# regions: 每个投注栏位 + 底部各自的外接矩形 (增量预览按区域重绘)
+LayoutPlan = namedtuple('LayoutPlan', ['name', 'size', 'guides', 'slots', 'passes', 'multi', 'regions'])
+# week: {"周三": box}; digits: (百位, 十位, 个位)，每位是 0-9 -> (box, ...); options: {"3": box}
+SlotPlan = namedtuple('SlotPlan', ['week', 'digits', 'options'])
+
+# === 位图盖章 (Bitmap Stamping) ===
+# 缓冲区为 1-bit 打包格式，每行 (width+7)//8 字节，高位在左。
+# 位极性与打印机一致: 1=打印(黑), 0=不打(白)；转 PIL 时用 rawmode '1;I' 反转。
+# 一个 box 覆盖的每个字节列，在缓冲区里是步长为 stride 的等差切片，
+# 因此整块可以用几次扩展切片赋值完成，不需要逐行循环。
+_OR_TABLES = {}
+
+def _or_table(mask):
+    table = _OR_TABLES.get(mask)
+    if table is None:
+        table = _OR_TABLES[mask] = bytes(b | mask for b in range(256))
+    return table
+
+def _box_stamp(stride, width, box):
+    """把一个 box 换算成字节列切片操作: (start, stop, 整字节填充 或 None, 部分字节 OR 表 或 None)"""
+    x0, y0, x1, y1 = box
+    x1 = min(x1, width - 1)
+    rows = y1 - y0 + 1
+    ops = []
+    for col in range(x0 >> 3, (x1 >> 3) + 1):
+        lo, hi = max(x0 - col * 8, 0), min(x1 - col * 8, 7)
+        mask = (0xFF >> lo) & (0xFF << (7 - hi)) & 0xFF
+        start, stop = y0 * stride + col, y1 * stride + col + 1
+        if mask == 0xFF: ops.append((start, stop, b'\xff' * rows, None))
+        else:            ops.append((start, stop, None, _or_table(mask)))
+    return tuple(ops)
+
+# 走预编译版面出答题卡的玩法 (basketball_{玩法}_{3|6})
+ROUTED_PLAY_TYPES = ("RFSF", "DXF")
+
 class OMREngine:
     def __init__(self):
+        # 两条出图路径：dispatch 用 ImageDraw 逐块绘制 (PIL Image，预览 / 调试用)；
+        # dispatch_raster / render_incremental 复制预渲染空白卡再位图盖章，直接得到打印机光栅
+        # (位图缓冲区再转 PIL Image 要逐像素解包，比直接 ImageDraw 慢，所以不作为 dispatch 的后端)
         self.maps = {}
         # 预加载所有配置文件
         map_list = [
@@ -25,9 +71,26 @@ class OMREngine:
                     self.maps[name] = json.load(f)
             except: pass
 
-    def _draw_block(self, draw, x, y, w, h, filled=True):
-        if filled: draw.rectangle([x, y, x+w, y+h], fill=0)
-        else: draw.rectangle([x, y, x+w, y+h], outline=0, fill=1)
+        # 路由层使用 meta.name (如 basketball_rfsf_3) 作为模板名
+        for name in list(self.maps):
+            cfg = self.maps[name]
+            self.maps.setdefault(cfg['meta']['name'], cfg)
+
+        # 加载时编译加法制模板，出票时不再遍历 JSON；文件名和 meta.name 两个键指向同一份编译结果
+        self.plans = {}
+        compiled = {}
+        for name, cfg in self.maps.items():
+            if cfg['meta'].get('type') in ('additive', 'additive_dual_layer'):
+                plan = compiled.get(id(cfg))
+                if plan is None:
+                    plan = compiled[id(cfg)] = self._compile_plan(cfg)
+                self.plans[name] = plan
+
+        # 光栅直出：每个模板一张预渲染空白卡 (锚点、分隔线已画好) + box 盖章表，按 plan.name 取用
+        self._blanks = {}
+        self._stamps = {}
+        for plan in compiled.values():
+            self._blanks[plan.name] = self._render_plan(plan, [], None, 0).tobytes('raw', '1;I')
 
     # === 辅助算法：加法制拆分 (3 -> [1,2]) ===
     def _get_additive_components(self, val):
@@ -39,150 +102,283 @@ class OMREngine:
                 temp -= v
         return res
 
-    # === 辅助算法：绘制通用倍数 ===
-    def _draw_multiplier_grid(self, draw, multi, cfg):
-        m_val = int(multi)
-        targets = []
-        # 假设 cfg['rows'] 里的 vals 是字符，需转换
-        all_vals = []
-        for r in cfg['rows']: 
-            for v in r['vals']: all_vals.append(int(v))
-        all_vals.sort(reverse=True)
-        
-        temp = m_val
-        for v in all_vals:
-            if temp >= v:
-                targets.append(str(v))
-                temp -= v
-        
-        start_x = cfg['start_x']
-        gap_x = cfg['gap_x']
-        for row in cfg['rows']:
-            for i, val_str in enumerate(row['vals']):
-                if val_str in targets:
-                    self._draw_block(draw, start_x + i*gap_x, row['y'], 25, 14)
-
-    # === 核心生成器：单层加法制 (RFSF3, DXF3) ===
-    def _generate_additive_3(self, bets, pass_type, multiplier, map_name):
-        cfg = self.maps.get(map_name)
-        if not cfg: return Image.new('1', (576, 100), 1)
-        
-        width, height = cfg['meta']['width'], cfg['meta']['height']
-        img = Image.new('1', (width, height), 1)
-        draw = ImageDraw.Draw(img)
-        
-        # 绘制锚点和线
-        draw.line([10, 120, 566, 120], fill=0, width=2)
-        draw.line([10, 450, 566, 450], fill=0, width=2)
-        for i in range(0, height, 30): draw.rectangle([0, i, 15, i+15], fill=0)
+    # === 版面编译：JSON -> LayoutPlan ===
+    def _compile_plan(self, cfg):
+        meta, layout = cfg['meta'], cfg['layout']
+        width, height = meta['width'], meta['height']
+        bw, bh = meta.get('block_w', 25), meta.get('block_h', 14)
+        box = lambda x, y: (x, y, x + bw, y + bh)
 
-        for idx, bet in enumerate(bets):
-            if idx >= 3: break
-            base_x = cfg['layout']['columns'][idx]['x_offset']
-            
-            # 解析周数和数字
-            week_str = bet['match'][:2]
-            num_str = ''.join(filter(str.isdigit, bet['match']))[-3:]
-            h, t, u = int(num_str[0]), int(num_str[1]), int(num_str[2])
-            
-            # 1. 涂周
-            if week_str in cfg['layout']['rows']['week']['map']:
-                wi = cfg['layout']['rows']['week']['map'].index(week_str)
+        # 3 关模板：行坐标为绝对值；6 关模板：上下两层，行坐标相对 base_y
+        if 'blocks' in layout:
+            rows = layout['rows_relative']
+            guides = (130, 560, 930)
+            bases = [layout['blocks']['top']['base_y']] * 3 + [layout['blocks']['bottom']['base_y']] * 3
+        else:
+            rows = layout['rows']
+            guides = (120, 450)
+            bases = [0] * 3
+
+        slots = []
+        for idx, base_y in enumerate(bases):
+            base_x = layout['columns'][idx % 3]['x_offset']
+
+            week_cfg = rows['week']
+            week = {}
+            for wi, week_str in enumerate(week_cfg['map']):
                 row_add = 30 if wi >= 4 else 0
-                wx = base_x + (wi % 4) * cfg['layout']['rows']['week']['gap_x']
-                self._draw_block(draw, wx, cfg['layout']['rows']['week']['start_y'] + row_add, 25, 14)
-
-            # 2. 涂编号 (加法)
-            num_cfg = cfg['layout']['rows']['match_num_additive']
-            for digit, key in zip([u, t, h], ['units', 'tens', 'hundreds']):
-                comps = self._get_additive_components(digit)
-                for i, val in enumerate(num_cfg[key]['vals']):
-                    if val in comps:
-                        self._draw_block(draw, base_x + i*35, num_cfg[key]['y'], 25, 14)
-
-            # 3. 涂选项
-            code = str(bet['machine_choice'])
-            opt_cfg = cfg['layout']['rows']['options']
-            if code in opt_cfg:
-                self._draw_block(draw, base_x + opt_cfg[code]['x_rel'], opt_cfg['label_y'], 25, 14)
-
-        # 4. 底部
-        if pass_type in cfg['layout']['footer']['pass']:
-            p = cfg['layout']['footer']['pass'][pass_type]
-            self._draw_block(draw, p['x'], p['y'], 25, 14)
-            
-        self._draw_multiplier_grid(draw, multiplier, cfg['layout']['footer']['multi'])
-        return img
+                week.setdefault(week_str, box(base_x + (wi % 4) * week_cfg['gap_x'], base_y + week_cfg['start_y'] + row_add))
 
-    # === 核心生成器：双层加法制 (RFSF6, DXF6) ===
-    def _generate_additive_6(self, bets, pass_type, multiplier, map_name):
-        cfg = self.maps.get(map_name)
-        if not cfg: return Image.new('1', (576, 100), 1)
-        
-        width, height = cfg['meta']['width'], cfg['meta']['height']
+            num_cfg = rows['match_num_additive']
+            digits = []
+            for key in ['hundreds', 'tens', 'units']:
+                per_digit = []
+                for digit in range(10):
+                    comps = self._get_additive_components(digit)
+                    per_digit.append(tuple(
+                        box(base_x + i * 35, base_y + num_cfg[key]['y'])
+                        for i, val in enumerate(num_cfg[key]['vals']) if val in comps
+                    ))
+                digits.append(tuple(per_digit))
+
+            opt_cfg = rows['options']
+            options = {
+                code: box(base_x + opt['x_rel'], base_y + opt_cfg['label_y'])
+                for code, opt in opt_cfg.items() if isinstance(opt, dict)
+            }
+            slots.append(SlotPlan(MappingProxyType(week), tuple(digits), MappingProxyType(options)))
+
+        footer = layout['footer']
+        passes = {pt: box(p['x'], p['y']) for pt, p in footer['pass'].items()}
+
+        # 倍数：按面值降序贪心；模板里的面值有字符串也有整数 (bb_rfsf_3)，统一按字符串归并
+        multi_cfg = footer['multi']
+        multi_boxes = {}
+        for row in multi_cfg['rows']:
+            for i, val in enumerate(row['vals']):
+                multi_boxes.setdefault(str(val), []).append(box(multi_cfg['start_x'] + i * multi_cfg['gap_x'], row['y']))
+        denoms = sorted((int(v) for r in multi_cfg['rows'] for v in r['vals']), reverse=True)
+        multi = tuple((v, tuple(multi_boxes.get(str(v), ()))) for v in denoms)
+
+        regions = [self._bounding_box([*s.week.values(), *(b for pos in s.digits for boxes in pos for b in boxes),
+                                       *s.options.values()]) for s in slots]
+        regions.append(self._bounding_box([*passes.values(), *(b for _, boxes in multi for b in boxes)]))
+
+        return LayoutPlan(meta['name'], (width, height), guides, tuple(slots), MappingProxyType(passes), multi,
+                          tuple(regions))
+
+    def _bounding_box(self, boxes):
+        if not boxes: return None
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def _collect_boxes(self, plan, bets, pass_type, multiplier):
+        """查表得到本张票所有需要涂黑的 box"""
+        boxes = []
+        for slot, bet in zip(plan.slots, bets):
+            boxes.extend(self._slot_boxes(slot, bet))
+        boxes.extend(self._footer_boxes(plan, pass_type, multiplier))
+        return boxes
+
+    def _slot_boxes(self, slot, bet):
+        boxes = []
+        # 场次按机器码涂写 ("周三5"、"3305" 都能对应到卡面)；无法对应时抛 ValueError
+        week, num_str = card_match_parts(bet['match'])
+        week_box = slot.week.get(week)
+        if week_box: boxes.append(week_box)
+
+        for pos, ch in zip(slot.digits, num_str):
+            boxes.extend(pos[int(ch)])
+
+        opt_box = slot.options.get(str(bet['machine_choice']))
+        if opt_box: boxes.append(opt_box)
+        return boxes
+
+    def _footer_boxes(self, plan, pass_type, multiplier):
+        boxes = []
+        pass_box = plan.passes.get(pass_mark(pass_type))
+        if pass_box: boxes.append(pass_box)
+
+        temp = int(multiplier)
+        for val, multi_boxes in plan.multi:
+            if temp >= val:
+                boxes.extend(multi_boxes)
+                temp -= val
+        return boxes
+
+    def _render_plan(self, plan, bets, pass_type, multiplier):
+        width, height = plan.size
         img = Image.new('1', (width, height), 1)
         draw = ImageDraw.Draw(img)
-        
-        draw.line([10, 130, 566, 130], fill=0, width=2)
-        draw.line([10, 560, 566, 560], fill=0, width=2)
-        draw.line([10, 930, 566, 930], fill=0, width=2)
+
+        for y in plan.guides: draw.line([10, y, 566, y], fill=0, width=2)
         for i in range(0, height, 30): draw.rectangle([0, i, 15, i+15], fill=0)
 
-        for idx, bet in enumerate(bets):
-            if idx >= 6: break
-            is_top = idx < 3
-            base_y = cfg['layout']['blocks']['top']['base_y'] if is_top else cfg['layout']['blocks']['bottom']['base_y']
-            col_idx = idx if is_top else idx - 3
-            base_x = cfg['layout']['columns'][col_idx]['x_offset']
-            rows_rel = cfg['layout']['rows_relative']
-            
-            # 解析
-            week_str = bet['match'][:2]
-            num_str = ''.join(filter(str.isdigit, bet['match']))[-3:]
-            h, t, u = int(num_str[0]), int(num_str[1]), int(num_str[2])
-            
-            # 1. 涂周
-            if week_str in rows_rel['week']['map']:
-                wi = rows_rel['week']['map'].index(week_str)
-                row_add = 30 if wi >= 4 else 0
-                wx = base_x + (wi % 4) * rows_rel['week']['gap_x']
-                self._draw_block(draw, wx, base_y + rows_rel['week']['start_y'] + row_add, 25, 14)
-                
-            # 2. 涂编号
-            num_cfg = rows_rel['match_num_additive']
-            for digit, key in zip([u, t, h], ['units', 'tens', 'hundreds']):
-                comps = self._get_additive_components(digit)
-                for i, val in enumerate(num_cfg[key]['vals']):
-                    if val in comps:
-                        self._draw_block(draw, base_x + i*35, base_y + num_cfg[key]['y'], 25, 14)
-                        
-            # 3. 涂选项
-            code = str(bet['machine_choice'])
-            if code in rows_rel['options']:
-                self._draw_block(draw, base_x + rows_rel['options'][code]['x_rel'], base_y + rows_rel['options']['label_y'], 25, 14)
-
-        # 4. 底部
-        if pass_type in cfg['layout']['footer']['pass']:
-            p = cfg['layout']['footer']['pass'][pass_type]
-            self._draw_block(draw, p['x'], p['y'], 25, 14)
-        self._draw_multiplier_grid(draw, multiplier, cfg['layout']['footer']['multi'])
+        for b in self._collect_boxes(plan, bets, pass_type, multiplier):
+            draw.rectangle(b, fill=0)
         return img
 
+    def _render_packed(self, plan, bets, pass_type, multiplier):
+        """位图盖章：复制空白卡，再按字节列切片把每个 box 盖进打包缓冲区"""
+        buf = bytearray(self._blanks[plan.name])
+        self._stamp_boxes(plan, buf, self._collect_boxes(plan, bets, pass_type, multiplier))
+        return buf
+
+    def _stamp_boxes(self, plan, buf, boxes):
+        width = plan.size[0]
+        stride = (width + 7) // 8
+        stamps = self._stamps
+        for b in boxes:
+            stamp = stamps.get(b)
+            if stamp is None:
+                stamp = stamps[b] = _box_stamp(stride, width, b)
+            for start, stop, fill, table in stamp:
+                if table is None: buf[start:stop:stride] = fill
+                else: buf[start:stop:stride] = buf[start:stop:stride].translate(table)
+
+    # === 增量预览：只重绘输入有变化的栏位 / 底部 ===
+    def _region_inputs(self, plan, bets, pass_type, multiplier):
+        inputs = []
+        for i in range(len(plan.slots)):
+            if i < len(bets):
+                inputs.append((*card_match_parts(bets[i]['match']), str(bets[i]['machine_choice'])))
+            else:
+                inputs.append(None)
+        mark = pass_mark(pass_type)
+        inputs.append((mark if mark in plan.passes else None, int(multiplier)))
+        return inputs
+
+    def render_incremental(self, state, bets, pass_type, multiplier, play_type="SF", capacity=None):
+        """
+        state: 上一次返回的预览状态 (首次为 None)
+        Returns: (new_state, dirty)
+            new_state 为 None 表示该玩法没有 OMR 模板；
+            dirty 为 None 表示整卡重绘，否则为变化区域的字节对齐矩形 [(x0, y0, x1, y1)]
+        """
+        plan = self._resolve_plan(bets, pass_type, play_type, capacity)
+        if not plan: return None, None
+        inputs = self._region_inputs(plan, bets, pass_type, multiplier)
+
+        if state is None or state['plan'] != plan.name:
+            buf = self._render_packed(plan, bets, pass_type, multiplier)
+            return {'plan': plan.name, 'size': plan.size, 'inputs': inputs, 'buf': buf}, None
+
+        # 复制一份再修改，避免并发请求共享同一缓冲区
+        buf = bytearray(state['buf'])
+        blank = self._blanks[plan.name]
+        stride = (plan.size[0] + 7) // 8
+        dirty = []
+        for i, (old, new) in enumerate(zip(state['inputs'], inputs)):
+            region = plan.regions[i]
+            if old == new or region is None: continue
+            x0, y0, x1, y1 = region
+            b0, b1 = x0 >> 3, (x1 >> 3) + 1
+            # 1. 从空白卡恢复该区域
+            for off in range(y0 * stride, (y1 + 1) * stride, stride):
+                buf[off + b0:off + b1] = blank[off + b0:off + b1]
+            # 2. 重新盖章
+            if i < len(plan.slots):
+                boxes = self._slot_boxes(plan.slots[i], bets[i]) if new else []
+            else:
+                boxes = self._footer_boxes(plan, pass_type, multiplier)
+            self._stamp_boxes(plan, buf, boxes)
+            dirty.append((b0 * 8, y0, b1 * 8 - 1, y1))
+        return {'plan': plan.name, 'size': plan.size, 'inputs': inputs, 'buf': buf}, dirty
+
     # === 路由分发 ===
-    def dispatch(self, bets, pass_type, multiplier, play_type="SF"):
-        is_6 = len(bets) > 3 or any(x in pass_type for x in ["4x","5x","6x"])
+    def _resolve_plan(self, bets, pass_type, play_type, capacity=None):
+        # capacity: 拆单时选定的模板容量 (票的 meta.capacity)；零头票场次少，不能按场次数重新挑模板
+        is_6 = capacity == 6 if capacity in (3, 6) else len(bets) > 3 or any(x in pass_type for x in ["4x","5x","6x"])
         
         if play_type == "SF":
             # 需保留之前的 SF 逻辑代码 (generate_bb_sf_3/6)，此处略去以聚焦新需求
-            pass 
-            
-        # === 核心：RFSF 和 DXF 的路由 ===
-        elif play_type == "RFSF":
-            if is_6: return self._generate_additive_6(bets, pass_type, multiplier, 'basketball_rfsf_6')
-            else:    return self._generate_additive_3(bets, pass_type, multiplier, 'basketball_rfsf_3')
-            
-        elif play_type == "DXF":
-            if is_6: return self._generate_additive_6(bets, pass_type, multiplier, 'basketball_dxf_6')
-            else:    return self._generate_additive_3(bets, pass_type, multiplier, 'basketball_dxf_3')
+            return None
             
+        # === 核心：RFSF 和 DXF 的路由 (走预编译版面) ===
+        if play_type in ROUTED_PLAY_TYPES:
+            return self.plans.get(f"basketball_{play_type.lower()}_{6 if is_6 else 3}")
+        return None
+
+    def template_capacities(self):
+        """
+        各玩法可用模板的容量和底部可选的过关方式，供 SportteryRuleEngine.register_templates 拆单规划
+        Returns: {"RFSF": {3: ("2x1", "3x1", "单关"), 6: (...)}, ...}
+        """
+        caps = {}
+        for play_type in ROUTED_PLAY_TYPES:
+            for size in (3, 6):
+                plan = self.plans.get(f"basketball_{play_type.lower()}_{size}")
+                if plan: caps.setdefault(play_type, {})[len(plan.slots)] = tuple(plan.passes)
+        return caps
+
+    def dispatch(self, bets, pass_type, multiplier, play_type="SF"):
+        plan = self._resolve_plan(bets, pass_type, play_type)
+        if plan: return self._render_plan(plan, bets, pass_type, multiplier)
         return Image.new('1', (576, 100), 1)
+
+    def dispatch_raster(self, bets, pass_type, multiplier, play_type="SF", capacity=None):
+        """
+        【光栅直出】不经过 PIL Image，直接返回 GS v 0 光栅数据
+        Returns: (x_bytes, height, data)，data 已是打印机位极性 (1=黑)，交给 EscPosDriver.raster_to_commands
+        模板宽度即 576 dots，无需缩放和反转
+        """
+        plan = self._resolve_plan(bets, pass_type, play_type, capacity)
+        if not plan: return 72, 100, bytes(72 * 100)
+        width, height = plan.size
+        return (width + 7) // 8, height, bytes(self._render_packed(plan, bets, pass_type, multiplier))
+
+    def render_ticket(self, ticket, pass_type, multiplier):
+        """
+        渲染 SportteryRuleEngine.generate_ticket_data 拆出的单张票
+        Returns: dispatch_raster 的光栅元组；该玩法没有 OMR 模板时返回 None
+        """
+        bets = self._ticket_bets(ticket)
+        plan = self._resolve_plan(bets, pass_type, ticket["meta"]["play_type"], ticket["meta"]["capacity"])
+        if not plan: return None
+        width, height = plan.size
+        return (width + 7) // 8, height, bytes(self._render_packed(plan, bets, pass_type, multiplier))
+
+    def _ticket_bets(self, ticket):
+        # 按规范化后的机器码涂写，卡面与二维码一致
+        return [{"match": h["match_code"], "machine_choice": h["machine_choice"]} for h in ticket["human_readable"]]
+
+    def check_ticket(self, ticket, pass_type):
+        """出票前校验：该票走答题卡时，每场都能涂写到卡面；Returns: 错误信息 或 None"""
+        bets = self._ticket_bets(ticket)
+        if not self._resolve_plan(bets, pass_type, ticket["meta"]["play_type"], ticket["meta"]["capacity"]): return None
+        for h in ticket["human_readable"]:
+            try:
+                card_match_parts(h["match_code"])
+            except ValueError:
+                return f"场次无法涂写到答题卡: {h['match_raw']}"
+        return None
+
+    def check_bets(self, bets, pass_type, multiplier, play_type="SF", capacity=None):
+        """预览前校验 (边输入边预览时常见半截场次、空倍数)；Returns: 错误信息 或 None"""
+        plan = self._resolve_plan(bets, pass_type, play_type, capacity)
+        if not plan: return None
+        msg = check_multiplier(multiplier)
+        if msg: return msg
+        for b in bets[:len(plan.slots)]:
+            try:
+                card_match_parts(b['match'])
+            except ValueError as e:
+                return str(e)
+        return None
+
+    # === 内容寻址：同一张卡面得到同一个哈希 ===
+    def card_key(self, bets, pass_type, multiplier, play_type="SF", capacity=None):
+        """
+        按渲染实际使用的输入 (模板、每场的周/编号/选项、过关、倍数) 计算规范化哈希
+        输入写法不同但卡面相同时 (如 "周三305" / "周三 305" / "3305") 得到同一个 key；无模板时返回 None
+        场次无法涂写到卡面时抛 ValueError
+        """
+        plan = self._resolve_plan(bets, pass_type, play_type, capacity)
+        if not plan: return None
+        slots = [[*card_match_parts(b['match']), str(b['machine_choice'])] for b in bets[:len(plan.slots)]]
+        mark = pass_mark(pass_type)
+        canon = [plan.name, slots, mark if mark in plan.passes else None, int(multiplier)]
+        return hashlib.sha1(json.dumps(canon, ensure_ascii=False, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    def ticket_key(self, ticket, pass_type, multiplier):
+        meta = ticket["meta"]
+        return self.card_key(self._ticket_bets(ticket), pass_type, multiplier, meta["play_type"], meta["capacity"])
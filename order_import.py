@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import codecs
+import csv
+import re
+import time
+from collections import deque
+
+from logic import normalize_match_id, card_match_parts
+from templates.parser import BatchParser
+
+# 表头别名 (代理导出的 CSV 表头不统一)；没有可识别的表头时按 场次,玩法,选项 的列顺序读取，
+# 只有一列时整格按批量文本格式 ("周三001-胜/平") 交给 BatchParser
+COLUMN_ALIASES = {
+    "match": ("match", "场次", "赛事编号", "编号"),
+    "type": ("type", "play_type", "玩法"),
+    "choice": ("choice", "选项", "投注", "投注内容"),
+}
+_MACHINE_ID_RE = re.compile(r'\d{4,5}')
+_NUMBER_CHOICE_RE = re.compile(r'[\d ,，+]+')
+
+# === 逐行读取 ===
+def sniff_encoding(path, size=65536):
+    """只看文件头判断编码：UTF-8 (含 BOM) 或 Excel 中文版常见的 GBK"""
+    with open(path, 'rb') as f:
+        head = f.read(size)
+    if head.startswith(codecs.BOM_UTF8): return "utf-8-sig"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "gbk"
+
+def iter_csv_rows(path, encoding=None):
+    with open(path, 'r', encoding=encoding or sniff_encoding(path), errors="replace", newline='') as f:
+        yield from csv.reader(f)
+
+def iter_xlsx_rows(path):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("读取 XLSX 需要安装 openpyxl (pip install openpyxl)")
+    # read_only 模式按行流式读取，不把整个工作表载入内存
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield ["" if v is None else str(v) for v in row]
+    finally:
+        wb.close()
+
+def iter_order_rows(path, encoding=None):
+    """
+    逐行读取订单文件 (CSV / XLSX)
+    Yields: (行号, {"match", "type", "choice"}) 或 (行号, {"text": 整行文本})
+    """
+    rows = iter_xlsx_rows(path) if path.lower().endswith((".xlsx", ".xlsm")) else iter_csv_rows(path, encoding)
+    columns = None
+    for row_no, row in enumerate(rows, 1):
+        cells = [c.strip() for c in row]
+        if not any(cells): continue
+        if columns is None and len([c for c in cells if c]) == 1:
+            yield row_no, {"text": next(c for c in cells if c)}
+            continue
+        if columns is None:
+            header = [c.lower() for c in cells]
+            columns = {key: next((header.index(a) for a in aliases if a in header), None)
+                       for key, aliases in COLUMN_ALIASES.items()}
+            if all(i is not None for i in columns.values()):
+                continue
+            columns = {"match": 0, "type": 1, "choice": 2}
+        yield row_no, {key: cells[i] if i < len(cells) else "" for key, i in columns.items()}
+
+# === 导入进度 ===
+class ImportProgress:
+    def __init__(self, name, max_errors=200):
+        self.name = name
+        self.status = "running"     # running -> done / error / aborted
+        self.rows = 0
+        self.valid = 0
+        self.invalid = 0
+        self.tickets = 0
+        # 只保留最近 max_errors 条错误明细，错误总数见 invalid
+        self.errors = deque(maxlen=max_errors)
+        self.msg = ""
+        self.job_id = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "rows": self.rows,
+            "valid": self.valid,
+            "invalid": self.invalid,
+            "tickets": self.tickets,
+            "errors": list(self.errors),
+            "msg": self.msg,
+            "job_id": self.job_id,
+            "created": self.created,
+            "finished": self.finished
+        }
+
+# === 订单导入 ===
+class OrderImporter:
+    """
+    CSV / XLSX 订单导入：逐行读取 -> 按 mappings.json 校验 -> SportteryRuleEngine.iter_ticket_data 流式拆单
+    整条链路都是生成器，交给 PrintQueue 后由打印线程边读边出票，内存与文件大小无关
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.text_parser = BatchParser(engine, workers=1)
+        self._codes = {}
+
+    def valid_codes(self, category, play_type):
+        key = (category, play_type)
+        codes = self._codes.get(key)
+        if codes is None:
+            play_map = self.engine.rules.get(category, {}).get(play_type)
+            codes = self._codes[key] = None if play_map is None else frozenset(
+                play_map.values() if isinstance(play_map, dict) else play_map)
+        return codes
+
+    def validate(self, row):
+        """Returns: 可直接交给 iter_ticket_data 的注单；不合法时抛 ValueError (中文原因)"""
+        match, play_type, choice = row["match"], row["type"].upper(), row["choice"]
+        if not (match and play_type and choice):
+            raise ValueError("缺少场次 / 玩法 / 选项")
+
+        category = self.engine.get_category(play_type)
+        codes = self.valid_codes(category, play_type)
+        if codes is None:
+            raise ValueError(f"未知玩法 {play_type}")
+
+        if category == "number":
+            if not _NUMBER_CHOICE_RE.fullmatch(choice):
+                raise ValueError(f"{play_type} 号码格式错误: {choice}")
+        else:
+            if not _MACHINE_ID_RE.fullmatch(normalize_match_id(match, category)):
+                raise ValueError(f"无法识别场次: {match}")
+            # 走答题卡的玩法：场次还要能涂写到卡面 (星期 + 三位编号)
+            if play_type in self.engine.template_caps:
+                card_match_parts(match)
+            if self.engine.get_code(category, play_type, choice) not in codes:
+                raise ValueError(f"{play_type} 没有选项: {choice}")
+        return {"match": match, "type": play_type, "choice": choice}
+
+    def row_bets(self, row_no, row):
+        """一行 -> 注单列表 (文本行可能一行多注)"""
+        if "text" not in row:
+            return [self.validate(row)]
+        result = self.text_parser.parse_line(row_no, row["text"])
+        if "error" in result:
+            raise ValueError(result["error"].split("解析失败: ", 1)[-1])
+        return [self.validate(b) for b in result["ticket"]["bets"]]
+
+    def iter_bets(self, path, progress, encoding=None):
+        """逐行校验，只产出合法注单；错误记入 progress"""
+        for row_no, row in iter_order_rows(path, encoding):
+            progress.rows += 1
+            try:
+                bets = self.row_bets(row_no, row)
+            except ValueError as e:
+                progress.invalid += 1
+                progress.errors.append(f"第 {row_no} 行: {e}")
+                continue
+            progress.valid += 1
+            yield from bets
+
+    def iter_tickets(self, path, pass_type, multiplier, progress, encoding=None, check=None):
+        """
+        逐张产出票面记录 (同 generate_ticket_data 的 tickets 项)，结束时更新 progress 状态
+        check(ticket): 出票前校验，返回错误信息时跳过该票并记入 progress，不中断整个作业
+        """
+        try:
+            for ticket in self.engine.iter_ticket_data(self.iter_bets(path, progress, encoding), pass_type, multiplier):
+                msg = check(ticket) if check else None
+                if msg:
+                    progress.errors.append(f"票 {ticket['machine_qr']}: {msg}")
+                    continue
+                progress.tickets += 1
+                yield ticket
+            progress.status = "done"
+        except Exception as e:
+            progress.status, progress.msg = "error", str(e)
+            raise
+        finally:
+            # 打印作业中途不再取票 (打印机离线、渲染出错) 时生成器被关闭，不经过 except
+            if progress.status == "running":
+                progress.status, progress.msg = "aborted", "出票作业已中断"
+            progress.finished = time.time()
+
+    def validate_file(self, path, progress, encoding=None):
+        """只校验不出票：跑完整个文件，结果见 progress"""
+        try:
+            for _ in self.iter_bets(path, progress, encoding): pass
+            progress.status = "done"
+        except Exception as e:
+            progress.status, progress.msg = "error", str(e)
+        finally:
+            progress.finished = time.time()
+        return progress
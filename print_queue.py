@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+
+# === 打印作业 ===
+class PrintJob:
+    def __init__(self, job_id, printer_name, tickets, batch=False):
+        self.id = job_id
+        self.printer = printer_name
+        # tickets: 每项为 ESC/POS 字节串，或返回字节串的无参函数 (在后台线程中渲染)
+        # 也可以是生成器：边拆单边出票，total 在生成器耗尽前为 None
+        self.tickets = tickets
+        self.batch = batch          # True: 所有票合并为一个假脱机文档
+        self.status = "queued"      # queued -> printing -> done / error
+        self.total = None if isinstance(tickets, Iterator) else len(tickets)
+        self.printed = 0
+        self.msg = ""
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "printer": self.printer,
+            "status": self.status,
+            "total": self.total,
+            "printed": self.printed,
+            "msg": self.msg,
+            "created": self.created,
+            "finished": self.finished
+        }
+
+# === 打印队列：接口只负责入队，每台打印机一个后台线程顺序出票 ===
+class PrintQueue:
+    def __init__(self, driver, max_history=200):
+        self.driver = driver
+        self.max_history = max_history
+        self._jobs = OrderedDict()
+        self._queues = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, printer_name, tickets, batch=False):
+        """入队并立即返回作业对象 (生成器不展开，由打印线程逐张取用)"""
+        if not isinstance(tickets, Iterator):
+            tickets = list(tickets)
+        with self._lock:
+            job = PrintJob(f"{int(time.time())}-{next(self._ids)}", printer_name, tickets, batch)
+            self._jobs[job.id] = job
+            self._trim_history()
+            q = self._queues.get(printer_name)
+            if q is None:
+                q = self._queues[printer_name] = queue.Queue()
+                threading.Thread(target=self._worker, args=(q,), name=f"spooler-{printer_name}", daemon=True).start()
+        q.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list_jobs(self):
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def pending(self, printer_name=None):
+        with self._lock:
+            return sum(1 for j in self._jobs.values()
+                       if j.status in ("queued", "printing") and printer_name in (None, j.printer))
+
+    def _trim_history(self):
+        # 只淘汰已结束的作业，排队中的作业始终可查
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_history: break
+            if self._jobs[job_id].status in ("done", "error"):
+                del self._jobs[job_id]
+
+    def _worker(self, q):
+        while True:
+            job = q.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                job.status, job.msg = "error", str(e)
+            finally:
+                job.finished = time.time()
+                # 生成器作业中途停止时显式关闭，让上游 (如订单导入) 的 finally 立即收尾
+                close = getattr(job.tickets, "close", None)
+                if close: close()
+                job.tickets = None  # 释放已打印数据
+                q.task_done()
+
+    def _run(self, job):
+        job.status = "printing"
+        render = lambda t: t() if callable(t) else t
+
+        if job.batch:
+            chunks = [render(t) for t in job.tickets]
+            job.total = len(chunks)
+            ok = self.driver.send_batch(job.printer, chunks)
+            if ok: job.printed = job.total
+        else:
+            ok = True
+            for t in job.tickets:
+                if not self.driver.send_raw(job.printer, render(t)):
+                    ok = False
+                    break
+                job.printed += 1
+            if ok: job.total = job.printed
+
+        if ok:
+            job.status = "done"
+        else:
+            job.status = "error"
+            job.msg = f"Printer '{job.printer}' not found or offline."
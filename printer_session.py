@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import threading
+
+# win32print 只在 Windows 上存在；模块级导入一次，避免每张票重复 import
+try:
+    import win32print
+except ImportError:
+    win32print = None
+
+# === 后端：负责真正的 打开 / 写入 / 关闭 ===
+# 每个后端实现 open(name) -> handle, write_doc(handle, chunks, doc_name, progress), close(handle)
+# progress["sent"]: 已交给打印机、不会被撤回的段数；写入失败后会话池从这里续发，不重打已出的票
+
+class Win32SpoolBackend:
+    """Windows 假脱机 RAW 打印 (默认后端)"""
+    def open(self, printer_name):
+        return win32print.OpenPrinter(printer_name)
+
+    def write_doc(self, handle, chunks, doc_name, progress):
+        # 一个假脱机文档内写入多段数据 (多张票)，只握手一次
+        win32print.StartDocPrinter(handle, 1, (doc_name, None, "RAW"))
+        try:
+            win32print.StartPagePrinter(handle)
+            for data in chunks:
+                win32print.WritePrinter(handle, data)
+            win32print.EndPagePrinter(handle)
+        except Exception:
+            # 写入失败：作废整份文档 (EndDocPrinter 会把写了一半的文档提交打印)，由会话池整份重发
+            try: win32print.AbortPrinter(handle)
+            except Exception: pass
+            raise
+        win32print.EndDocPrinter(handle)
+        # 文档提交后才算送达
+        progress["sent"] += len(chunks)
+
+    def close(self, handle):
+        win32print.ClosePrinter(handle)
+
+class FileBackend:
+    """文件替身：每台打印机对应目录下的一个 .bin 文件，追加写入 (Linux 调试 / 测试用)"""
+    def __init__(self, directory="print_spool"):
+        self.directory = directory
+
+    def open(self, printer_name):
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in printer_name)
+        return open(os.path.join(self.directory, f"{safe_name}.bin"), 'ab')
+
+    def write_doc(self, handle, chunks, doc_name, progress):
+        for data in chunks:
+            handle.write(data)
+            handle.flush()
+            progress["sent"] += 1
+
+    def close(self, handle):
+        handle.close()
+
+class SocketBackend:
+    """网络打印机 RAW 端口 (JetDirect)，打印机名写成 "host" 或 "host:port" """
+    def __init__(self, default_port=9100, timeout=5):
+        self.default_port = default_port
+        self.timeout = timeout
+
+    def open(self, printer_name):
+        host, _, port = printer_name.partition(':')
+        return socket.create_connection((host, int(port or self.default_port)), timeout=self.timeout)
+
+    def write_doc(self, handle, chunks, doc_name, progress):
+        # RAW 端口收到即打印，发出去的段无法撤回
+        for data in chunks:
+            handle.sendall(data)
+            progress["sent"] += 1
+
+    def close(self, handle):
+        handle.close()
+
+def default_backend():
+    return Win32SpoolBackend() if win32print else None
+
+# === 会话池：按打印机名常驻句柄，失败自动重连 ===
+class PrinterSessionPool:
+    def __init__(self, backend=None, retries=1):
+        self.backend = backend or default_backend()
+        self.retries = retries
+        self._handles = {}
+        self._locks = {}
+        self._pool_lock = threading.Lock()
+
+    def _lock_for(self, printer_name):
+        with self._pool_lock:
+            return self._locks.setdefault(printer_name, threading.Lock())
+
+    def _drop(self, printer_name):
+        handle = self._handles.pop(printer_name, None)
+        if handle is not None:
+            try: self.backend.close(handle)
+            except Exception: pass
+
+    def send(self, printer_name, data, doc_name="PrintBet Job"):
+        return self.send_batch(printer_name, [data], doc_name)
+
+    def send_batch(self, printer_name, chunks, doc_name="PrintBet Job"):
+        """
+        把多段数据 (多张票) 作为一个假脱机文档发送
+        句柄按打印机名复用；失败时关闭旧句柄、重连后只续发尚未送达的段
+        """
+        chunks = [c for c in chunks if c]
+        if not chunks: return False
+        if self.backend is None:
+            print("[Printer Session] No printer backend available on this platform")
+            return False
+
+        progress = {"sent": 0}
+        with self._lock_for(printer_name):
+            for attempt in range(self.retries + 1):
+                try:
+                    handle = self._handles.get(printer_name)
+                    if handle is None:
+                        handle = self._handles[printer_name] = self.backend.open(printer_name)
+                    self.backend.write_doc(handle, chunks[progress["sent"]:], doc_name, progress)
+                    return True
+                except Exception as e:
+                    print(f"[Printer Session] {printer_name} attempt {attempt + 1} failed after "
+                          f"{progress['sent']}/{len(chunks)} chunks: {e}")
+                    self._drop(printer_name)
+            return False
+
+    def close(self, printer_name):
+        with self._lock_for(printer_name):
+            self._drop(printer_name)
+
+    def close_all(self):
+        for name in list(self._handles):
+            self.close(name)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from driver import EscPosDriver
+from omr_engine import OMREngine
+
+# === 单张票 -> ESC/POS 指令 ===
+def render_ticket_commands(engine, driver, ticket, pass_type, multiplier):
+    """有 OMR 模板的玩法输出光栅答题卡，否则退回文本票 (各自带切纸)"""
+    raster = engine.render_ticket(ticket, pass_type, multiplier)
+    if raster:
+        return driver.raster_to_commands(*raster)
+    text_ticket = {
+        "title": ticket["title"],
+        "human_readable": [{"match": f"{h['match_raw']} {h['choice']}"} for h in ticket["human_readable"]]
+    }
+    return driver.build_escpos(text_ticket, ticket["machine_qr"], pass_type, multiplier)
+
+# === 预热进程池 (渲染服务 / 本地 OCR 引擎池共用) ===
+_warm_barrier = None
+
+def _warm_pool_init(barrier, initializer, initargs):
+    global _warm_barrier
+    _warm_barrier = barrier
+    initializer(*initargs)
+
+def _warm_worker(timeout):
+    # 预热任务卡在屏障上，直到 workers 个进程各领到一个：先就绪的进程不能把预热任务全部抢走
+    _warm_barrier.wait(timeout=timeout)
+    return os.getpid()
+
+class WarmPool:
+    """
+    进程池 + 启动预热：每个工作进程跑完子类的 initializer 后在屏障处等齐，start() 返回时全部就绪
+    子类实现 _pool_initializer() -> (initializer, initargs)；
+    workers <= 1 时不建进程池，由 _warm_inline() 在本进程预热
+    """
+    label = "Pool"
+    # 等齐全部工作进程的上限 (秒)
+    warm_timeout = 60
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.state = "idle"          # idle -> warming -> ready / error / unavailable
+        self.ready = False
+        self.error = None
+        self.ready_workers = 0
+        self.warmup_ms = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool_initializer(self):
+        raise NotImplementedError
+
+    def _warm_inline(self):
+        pass
+
+    def _unavailable(self):
+        """Returns: 无法启动的原因 (如缺少依赖) 或 None"""
+        return None
+
+    def start(self):
+        """拉起并预热进程池 (阻塞到全部就绪；应用启动时放在后台线程里调用，并发调用者等同一次预热)"""
+        with self._lock:
+            if self.state != "idle": return self
+            reason = self._unavailable()
+            if reason:
+                self.state, self.error = "unavailable", reason
+                return self
+            self.state = "warming"
+            start = time.perf_counter()
+            try:
+                if self.workers > 1:
+                    initializer, initargs = self._pool_initializer()
+                    barrier = multiprocessing.Barrier(self.workers)
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_pool_init,
+                                                         initargs=(barrier, initializer, initargs))
+                    pids = set()
+                    for fut in as_completed([self._executor.submit(_warm_worker, self.warm_timeout)
+                                             for _ in range(self.workers)]):
+                        pids.add(fut.result())
+                        self.ready_workers = len(pids)
+                else:
+                    self._warm_inline()
+                    self.ready_workers = 1
+                self.warmup_ms = round((time.perf_counter() - start) * 1000, 1)
+                self.state, self.ready = "ready", True
+                print(f"[{self.label}] {self.workers} worker(s) ready in {self.warmup_ms:.0f} ms")
+            except Exception as e:
+                self.state, self.error = "error", str(e) or type(e).__name__
+                print(f"[{self.label}] Warm-up failed ({self.ready_workers}/{self.workers} ready): {self.error}")
+        return self
+
+    def status(self):
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "workers": self.workers,
+            "ready_workers": self.ready_workers,
+            "warmup_ms": self.warmup_ms,
+            "error": self.error
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            self.state, self.ready, self.ready_workers = "idle", False, 0
+
+# === 渲染进程池工作进程：每个进程启动时只加载一次 omr_maps ===
+_worker_engine = None
+_worker_driver = None
+
+def _init_worker(compact_raster):
+    global _worker_engine, _worker_driver
+    _worker_engine = OMREngine()
+    _worker_driver = EscPosDriver(compact_raster=compact_raster)
+
+def _render_in_worker(args):
+    tickets, pass_type, multiplier, raw = args
+    if raw:
+        return [_worker_engine.render_ticket(t, pass_type, multiplier) for t in tickets]
+    return [render_ticket_commands(_worker_engine, _worker_driver, t, pass_type, multiplier) for t in tickets]
+
+# === 渲染服务 ===
+class RenderService(WarmPool):
+    """
+    把 generate_ticket_data 拆出的票分发到进程池并行渲染，结果保持原顺序
+    票数少于 inline_threshold 时直接在本进程渲染 (进程间传输的开销比渲染本身还大)
+    """
+    label = "Render"
+
+    def __init__(self, workers=None, compact_raster=False, inline_threshold=8, cache=None):
+        super().__init__(workers or os.cpu_count() or 1)
+        self.compact_raster = compact_raster
+        self.inline_threshold = inline_threshold
+        # cache: cache_store.LRUCache，按卡面哈希缓存光栅 / 指令，重打同一张票不再渲染
+        self.cache = cache
+        # 本进程内的渲染器，用于小单降级
+        self._engine = OMREngine()
+        self._driver = EscPosDriver(compact_raster=compact_raster)
+
+    def _pool_initializer(self):
+        return _init_worker, (self.compact_raster,)
+
+    def render_rasters(self, tickets, pass_type, multiplier):
+        """Returns: 每张票的 (x_bytes, height, data)；无 OMR 模板的票为 None"""
+        return self._render(tickets, pass_type, multiplier, raw=True)
+
+    def render_commands(self, tickets, pass_type, multiplier):
+        """Returns: 每张票可直接发送的 ESC/POS 指令"""
+        return self._render(tickets, pass_type, multiplier, raw=False)
+
+    def _render(self, tickets, pass_type, multiplier, raw):
+        tickets = list(tickets)
+        if self.cache is None:
+            return self._render_uncached(tickets, pass_type, multiplier, raw)
+
+        # 文本票 (无 OMR 模板) 带打印时间，key 为 None，不缓存
+        kind = "raster" if raw else ("compact" if self.compact_raster else "cmd")
+        keys = [self._engine.ticket_key(t, pass_type, multiplier) for t in tickets]
+        results = [self.cache.get((kind, k)) if k else None for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            rendered = self._render_uncached([tickets[i] for i in missing], pass_type, multiplier, raw)
+            for i, r in zip(missing, rendered):
+                results[i] = r
+                if keys[i] and r is not None:
+                    self.cache.put((kind, keys[i]), r, len(r[2]) if raw else len(r))
+        return results
+
+    def _render_uncached(self, tickets, pass_type, multiplier, raw):
+        # 进程池没拉起来 (预热失败) 时也退回本进程渲染
+        if len(tickets) < self.inline_threshold or self.workers <= 1 or self.start()._executor is None:
+            if raw:
+                return [self._engine.render_ticket(t, pass_type, multiplier) for t in tickets]
+            return [render_ticket_commands(self._engine, self._driver, t, pass_type, multiplier) for t in tickets]
+
+        # 按块分发，减少进程间往返；块数约为进程数的 4 倍以均衡负载
+        size = max(1, len(tickets) // (self.workers * 4))
+        batches = [(tickets[i:i + size], pass_type, multiplier, raw) for i in range(0, len(tickets), size)]
+        results = []
+        for part in self._executor.map(_render_in_worker, batches):
+            results.extend(part)
+        return results
@@ -1,9 +1,152 @@
 # -*- coding: utf-8 -*-
+import io
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+
+# === 预编译正则 ===
+# 一行 = 场次 + 分隔符 + 选项；先找紧跟在场次后面的显式分隔符，没有时才按空白切开
+# 场次可以是 "周三 001" (周几与编号之间带空白)；比分选项里的 ":" 不会被误当成分隔符:
+# "周三 001-胜" -> ("周三 001", "胜")，"周三001 1:0" -> ("周三001", "1:0")
+DEFAULT_DELIMITERS = "-:："
+_CHOICE_SPLIT_RE = re.compile(r'[,/，、]')
+# 半全场选项 (胜胜=33 ...)
+_BQC_CODES = frozenset(["33", "31", "30", "13", "11", "10", "03", "01", "00"])
+
+@lru_cache(maxsize=16)
+def _line_patterns(delimiter):
+    """Returns: (显式分隔符, 空白分隔) 两个正则，按顺序尝试"""
+    delims = re.escape(DEFAULT_DELIMITERS + (delimiter or ""))
+    match = rf'(?P<match>(?:[^\s\d{delims}]+\s+)?[^\s{delims}]+)'
+    return (re.compile(rf'^{match}\s*[{delims}]\s*(?P<choices>.+)$'),
+            re.compile(rf'^{match}\s+(?P<choices>.+)$'))
+
+def iter_lines(source, encoding="utf-8"):
+    """
+    把导入源变成逐行迭代 (不整体读入内存)
+    source: 文本 / bytes / 文本或二进制文件对象 (含上传文件、请求体流) / 任意行迭代器
+    二进制文件对象直接逐行迭代再自行解码：Werkzeug 上传文件底层的 SpooledTemporaryFile
+    在 Python 3.9 / 3.10 上缺少 readable()，不能套 io.TextIOWrapper
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    elif isinstance(source, (bytes, bytearray)):
+        source = io.StringIO(source.decode(encoding, errors="replace"))
+    for line in source:
+        if not isinstance(line, str):
+            line = line.decode(encoding, errors="replace")
+        yield line.lstrip('\ufeff')
+
+# === 进程池工作进程：每个进程启动时只加载一次映射表 ===
+_worker_parser = None
+
+def _init_worker():
+    global _worker_parser
+    from logic import SportteryRuleEngine
+    _worker_parser = BatchParser(SportteryRuleEngine(), workers=1)
+
+def _parse_in_worker(args):
+    numbered_lines, delimiter = args
+    return [_worker_parser.parse_line(no, line, delimiter) for no, line in numbered_lines]
 
 class BatchParser:
-    def __init__(self, logic_instance):
+    """
+    批量文本导入: 每行 "周三001-胜/平" 解析为一张单关票
+    iter_parse 逐行产出结果；parse_stream 把行按块分发到进程池并行解析，结果保持原顺序
+    """
+    def __init__(self, logic_instance, delimiter="-", workers=None, chunk_lines=2000):
         self.logic = logic_instance
+        self.delimiter = delimiter
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_lines = chunk_lines
+        self._executor = None
+
+    def parse_line(self, line_no, line, delimiter=None):
+        """
+        delimiter: 额外允许的分隔符 (默认的 "-"、":"、空白始终可用)
+        Returns: {"line": 行号, "ticket": {...}} / {"line": 行号, "error": "..."} / None (空行、注释)
+        """
+        line = line.strip()
+        if not line or line.startswith("#"): return None
+        try:
+            explicit, spaced = _line_patterns(delimiter or self.delimiter)
+            m = explicit.match(line) or spaced.match(line)
+            if not m:
+                raise ValueError("格式错误，缺少选项部分")
+
+            # 场次清洗
+            match_id = self.logic.normalize_match_id(m.group('match'))
+
+            # 选项解析
+            bets = []
+            for c in _CHOICE_SPLIT_RE.split(m.group('choices')):
+                c = c.strip().replace("：", ":")
+                if not c: continue
+
+                # 简单的玩法推断
+                play_type = "SPF"
+                if ":" in c: play_type = "CBF"
+                elif c in _BQC_CODES: play_type = "BQC"
+
+                bets.append({
+                    "match": match_id,
+                    "type": play_type,
+                    "choice": c,
+                    "machine_choice": self.logic.get_code('football', play_type, c)
+                })
+
+            if not bets:
+                raise ValueError("未解析到有效选项")
+
+            return {"line": line_no, "ticket": {"id": line_no, "raw": line, "bets": bets, "passType": "1x1"}}
+        except Exception as e:
+            # 这里返回中文错误信息
+            return {"line": line_no, "error": f"第 {line_no} 行: '{line}' -> 解析失败: {str(e)}"}
+
+    def iter_parse(self, source, delimiter=None):
+        """单进程逐行解析，边读边产出"""
+        for no, line in enumerate(iter_lines(source), 1):
+            result = self.parse_line(no, line, delimiter)
+            if result: yield result
+
+    def parse_stream(self, source, delimiter=None):
+        """
+        大批量导入：行按 chunk_lines 分块交给进程池，最多同时在途 workers * 2 块 (内存有界)
+        不足一块或单核时直接在本进程解析
+        """
+        numbered = enumerate(iter_lines(source), 1)
+        first = list(islice(numbered, self.chunk_lines))
+        if len(first) < self.chunk_lines or self.workers <= 1:
+            for no, line in chain(first, numbered):
+                result = self.parse_line(no, line, delimiter)
+                if result: yield result
+            return
+
+        executor = self._start()
+        pending = deque([executor.submit(_parse_in_worker, (first, delimiter))])
+        exhausted = False
+        while pending:
+            while not exhausted and len(pending) < self.workers * 2:
+                block = list(islice(numbered, self.chunk_lines))
+                if not block:
+                    exhausted = True
+                    break
+                pending.append(executor.submit(_parse_in_worker, (block, delimiter)))
+            for result in pending.popleft().result():
+                if result: yield result
+
+    def _start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
     def parse_text_content(self, raw_text, delimiter="-"):
         """
@@ -11,62 +154,7 @@ class BatchParser:
         """
         valid_tickets = []
         errors = []
-        
-        lines = raw_text.strip().split('\n')
-        
-        for line_idx, line in enumerate(lines):
-            line = line.strip()
-            if not line or line.startswith("#"): continue
-
-            try:
-                # 智能探测分隔符
-                if delimiter not in line:
-                    if ":" in line: delimiter = ":"
-                    elif " " in line: delimiter = " "
-                
-                parts = line.split(delimiter)
-                if len(parts) < 2:
-                    raise ValueError("格式错误，缺少选项部分")
-
-                match_raw = parts[0].strip()
-                choices_raw = parts[1].strip()
-
-                # 场次清洗
-                match_id = self.logic.normalize_match_id(match_raw)
-                
-                # 选项解析
-                sub_choices = re.split(r'[,/，]', choices_raw)
-                
-                bets = []
-                for c in sub_choices:
-                    c = c.strip()
-                    if not c: continue
-                    
-                    # 简单的玩法推断
-                    play_type = "SPF" 
-                    if ":" in c: play_type = "CBF"
-                    elif len(c) >= 2 and c in ["33","31","30","13","11","10","03","01","00"]: play_type = "BQC"
-
-                    m_code = self.logic.get_machine_code('football', play_type, c)
-                    bets.append({
-                        "match": match_id,
-                        "type": play_type,
-                        "choice": c,
-                        "machine_choice": m_code
-                    })
-
-                if not bets:
-                    raise ValueError("未解析到有效选项")
-
-                valid_tickets.append({
-                    "id": line_idx + 1,
-                    "raw": line,
-                    "bets": bets,
-                    "passType": "1x1"
-                })
-
-            except Exception as e:
-                # 这里返回中文错误信息
-                errors.append(f"第 {line_idx+1} 行: '{line}' -> 解析失败: {str(e)}")
-
+        for result in self.iter_parse(raw_text, delimiter):
+            if "error" in result: errors.append(result["error"])
+            else: valid_tickets.append(result["ticket"])
         return {"tickets": valid_tickets, "errors": errors}